@@ -0,0 +1,91 @@
+"""
+Staffing analytics over clock-in sessions.
+
+Every function here is pure: it takes session spans as parallel lists of UTC epoch
+seconds (start, end) and returns plain data, so it can run on any thread or process.
+The work is one sort of the 2n start/stop events plus a linear sweep: O(n log n).
+"""
+import datetime
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+
+class StaffingStats(NamedTuple):
+    sessions: int                 # sessions overlapping the window
+    peak: int                     # most people on duty at the same time
+    peak_at: int | None           # first instant (epoch) the peak was reached
+    below_min_seconds: int        # time with fewer than min_headcount on duty
+    hourly_avg: list[float]       # average headcount per local hour of day (0-23)
+    daily_peaks: dict[str, int]   # local 'YYYY-MM-DD' -> peak headcount that day
+
+
+def staffing_stats(starts: list[int], ends: list[int | None], window_start: int, window_end: int,
+                   tz: ZoneInfo, *, min_headcount: int = 0, now: int | None = None) -> StaffingStats:
+    """
+    Sweep-line over the sessions clipped to [window_start, window_end).
+    Open sessions (end None) count until `now` (default: window_end).
+    A clock-out and a clock-in at the same second are a hand-over, not an overlap.
+    """
+    open_end = window_end if now is None else now
+    events: list[tuple[int, int]] = []
+    for start, end in zip(starts, ends):
+        start = max(start, window_start)
+        end = min(open_end if end is None else end, window_end)
+        if end > start:
+            events.append((start, 1))
+            events.append((end, -1))
+    events.sort()  # -1 before +1 at the same instant
+
+    # Local hour / date per UTC hour bucket (offsets are whole hours for the bot's timezone)
+    local: dict[int, tuple[int, str]] = {}
+
+    def local_of(bucket: int) -> tuple[int, str]:
+        v = local.get(bucket)
+        if v is None:
+            dt = datetime.datetime.fromtimestamp(bucket * 3600, tz)
+            v = local[bucket] = (dt.hour, dt.date().isoformat())
+        return v
+
+    person_seconds = [0] * 24
+    hour_seconds = [0] * 24
+    daily_peaks: dict[str, int] = {}
+    peak = 0
+    peak_at = None
+    below = 0
+
+    def span(a: int, b: int, count: int) -> None:
+        # Constant headcount on [a, b); split at hour boundaries for the histogram
+        nonlocal peak, peak_at, below
+        if count < min_headcount:
+            below += b - a
+        if count > peak:
+            peak, peak_at = count, a
+        while a < b:
+            bucket = a // 3600
+            nxt = min(b, (bucket + 1) * 3600)
+            hour, day = local_of(bucket)
+            person_seconds[hour] += count * (nxt - a)
+            hour_seconds[hour] += nxt - a
+            if count > daily_peaks.get(day, -1):
+                daily_peaks[day] = count
+            a = nxt
+
+    count = 0
+    prev = window_start
+    for t, delta in events:
+        if t > prev:
+            span(prev, t, count)
+            prev = t
+        count += delta
+    if window_end > prev:
+        span(prev, window_end, count)
+
+    hourly_avg = [person_seconds[h] / hour_seconds[h] if hour_seconds[h] else 0.0 for h in range(24)]
+    return StaffingStats(len(events) // 2, peak, peak_at, below, hourly_avg, daily_peaks)
+
+
+def local_day_window(date_from: str, date_to: str, tz: ZoneInfo) -> tuple[int, int]:
+    """[start of date_from, start of the day after date_to) in local time, as epoch seconds."""
+    first = datetime.datetime.fromisoformat(date_from).replace(tzinfo=tz)
+    last = (datetime.datetime.fromisoformat(date_to) + datetime.timedelta(days=1)).replace(tzinfo=tz)
+    return int(first.timestamp()), int(last.timestamp())
@@ -1,9 +1,390 @@
+import os
 import sqlite3
+import asyncio
 import datetime
+import functools
+import logging
+import threading
+import queue
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from zoneinfo import ZoneInfo
+
+DB_PATH = 'clock_times.db'
+PUNISH_DB_PATH = 'punishments.db'  # legacy warn counters, imported into DB_PATH by schema v5
+WARN_LIMIT = 3
+
+# Applied to every new connection (most of these are per-connection settings in SQLite).
+CONNECTION_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL;",       # must precede WAL to apply to a new file
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA wal_autocheckpoint=1000;",      # checkpoint roughly every ~1k pages
+    "PRAGMA journal_size_limit=10485760;",   # cap WAL to ~10 MB
+    "PRAGMA temp_store=MEMORY;",             # avoid /tmp writes
+    "PRAGMA busy_timeout=5000;",             # wait on locks instead of failing
+    "PRAGMA cache_size=-8000;",              # ~8 MB page cache per connection
+)
+STATEMENT_CACHE_SIZE = 256
+
+# Group commit: the writer collects queued writes for up to GROUP_COMMIT_WINDOW seconds
+# (at most GROUP_COMMIT_MAX ops) and commits them together, one fsync per batch.
+GROUP_COMMIT_WINDOW = 0.003
+GROUP_COMMIT_MAX = 64
+
+# Departments stored in the sessions table (dept column)
+DEPT_PD = 'PD'
+DEPT_SAS = 'SAS'
+DEPARTMENTS = (DEPT_PD, DEPT_SAS)
+
+
+# ---------- Time helpers ----------
+# Sessions keep their local TEXT date/clock_in/clock_out (what the bot shows) and, since
+# schema v2, the same instants as UTC epoch seconds plus the rounded duration in minutes.
+
+@functools.lru_cache(maxsize=1)
+def _local_tz() -> ZoneInfo:
+    # Resolved lazily: the bot loads .env after importing this module
+    return ZoneInfo(os.getenv("TIMEZONE", "Europe/Bucharest"))
+
+def to_epoch(date: str, time_str: str) -> int:
+    """Local 'YYYY-MM-DD' + 'HH:MM:SS' -> UTC epoch seconds."""
+    dt = datetime.datetime.fromisoformat(f"{date} {time_str}")
+    return int(dt.replace(tzinfo=_local_tz()).timestamp())
+
+def session_minutes(start_ts: int | None, end_ts: int | None) -> int | None:
+    """Duration rounded to 5 minutes, same rule as round_minutes() in the bot."""
+    if start_ts is None or end_ts is None:
+        return None
+    return round((end_ts - start_ts) / 60 / 5) * 5
+
+def _setup_connection(conn: sqlite3.Connection) -> None:
+    conn.create_function("session_minutes", 2, session_minutes, deterministic=True)
+
+
+class ConnectionManager:
+    """
+    Keeps one long-lived connection per thread for a database file.
+    Connections are opened lazily, configured once with CONNECTION_PRAGMAS and
+    keep a prepared statement cache, so a helper call is just execute + fetch.
+    Transactions are explicit (autocommit mode + BEGIN/COMMIT in transaction()); a
+    transaction() opened while one is already active becomes a SAVEPOINT inside it.
+    """
+    def __init__(self, path: str, on_connect=None):
+        self.path = path
+        self._on_connect = on_connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: list[sqlite3.Connection] = []
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                isolation_level=None,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+            for pragma in CONNECTION_PRAGMAS:
+                try:
+                    conn.execute(pragma)
+                except sqlite3.DatabaseError:
+                    pass
+            if self._on_connect:
+                self._on_connect(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.get()
+        if conn.in_transaction:
+            # Nested (e.g. inside a group-commit batch): only this block is undone on error
+            mark = self.touch_mark()
+            conn.execute("SAVEPOINT tx")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK TO tx")
+                conn.execute("RELEASE tx")
+                self.discard_touched(mark)
+                raise
+            else:
+                conn.execute("RELEASE tx")
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self.discard_touched()
+            raise
+        else:
+            conn.execute("COMMIT")
+            self.publish_touched()
+
+    # Rows changed by the current transaction, as (dept, user_id, date) keys. They are
+    # handed to the write listeners only once the transaction has committed.
+    def _touched(self) -> list:
+        touched = getattr(self._local, "touched", None)
+        if touched is None:
+            touched = self._local.touched = []
+        return touched
+
+    def touch(self, *keys: tuple) -> None:
+        self._touched().extend(keys)
+
+    def touch_mark(self) -> int:
+        return len(self._touched())
+
+    def discard_touched(self, mark: int = 0) -> None:
+        del self._touched()[mark:]
+
+    def publish_touched(self) -> None:
+        touched = self._touched()
+        if touched:
+            keys, touched[:] = list(touched), []
+            _notify_write_listeners(keys)
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+
+_db = ConnectionManager(DB_PATH, on_connect=_setup_connection)
+
+
+# ---------- Write listeners ----------
+# Callbacks notified after each commit with the (dept, user_id, date) keys it changed;
+# (None, None, None) means "anything may have changed" (e.g. a rollup rebuild).
+# They run on the writing thread (normally the db-writer) and must be quick and thread-safe.
+_write_listeners: list = []
+_write_listeners_lock = threading.Lock()
+ALL_CHANGED = (None, None, None)
+
+def add_write_listener(fn) -> None:
+    with _write_listeners_lock:
+        if fn not in _write_listeners:
+            _write_listeners.append(fn)
+
+def remove_write_listener(fn) -> None:
+    with _write_listeners_lock:
+        if fn in _write_listeners:
+            _write_listeners.remove(fn)
+
+def _notify_write_listeners(keys: list[tuple]) -> None:
+    with _write_listeners_lock:
+        listeners = list(_write_listeners)
+    for fn in listeners:
+        try:
+            fn(keys)
+        except Exception:
+            logging.exception("DB write listener %r failed", fn)
+
+
+class _WriteOp:
+    __slots__ = ("fn", "future", "exclusive", "queued_at")
+
+    def __init__(self, fn, exclusive: bool):
+        self.fn = fn
+        self.future: Future = Future()
+        self.exclusive = exclusive
+        self.queued_at = time.perf_counter()
+
+
+class GroupCommitWriter:
+    """
+    Single writer thread for DB_PATH. Writes queued within a few milliseconds of each other
+    run in one transaction (each inside its own SAVEPOINT) and are committed together, so a
+    burst of clicks pays for one fsync instead of one per click. A failing op only rolls back
+    its own savepoint and gets its own exception; if the COMMIT itself fails, every op of
+    the batch gets that error. Exclusive ops (VACUUM, checkpoints) run alone, outside a batch.
+    """
+    def __init__(self, window: float = GROUP_COMMIT_WINDOW, max_batch: int = GROUP_COMMIT_MAX):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._held: _WriteOp | None = None
+        # Recent queue->commit latencies (seconds) and batch sizes, for db_stats()
+        self.latencies: deque = deque(maxlen=2000)
+        self.batch_sizes: deque = deque(maxlen=500)
+
+    def submit(self, fn, exclusive: bool = False) -> Future:
+        op = _WriteOp(fn, exclusive)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        self._queue.put(op)
+        return op.future
+
+    def stop(self) -> None:
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _next_batch(self) -> list[_WriteOp] | None:
+        first = self._held if self._held is not None else self._queue.get()
+        self._held = None
+        if first is None:
+            return None
+        batch = [first]
+        if first.exclusive:
+            return batch
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                op = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if op is None or op.exclusive:
+                # Commit what we have first; the stop marker / exclusive op comes next round
+                self._held = op
+                break
+            batch.append(op)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch[0].exclusive:
+                self._run_exclusive(batch[0])
+            else:
+                self._run_batch(batch)
+
+    def _run_exclusive(self, op: _WriteOp) -> None:
+        try:
+            result = op.fn()
+        except BaseException as e:
+            op.future.set_exception(e)
+        else:
+            op.future.set_result(result)
+        self.latencies.append(time.perf_counter() - op.queued_at)
+
+    def _run_batch(self, batch: list[_WriteOp]) -> None:
+        outcomes = []
+        try:
+            conn = _db.get()
+            conn.execute("BEGIN IMMEDIATE")
+        except BaseException as e:
+            for op in batch:
+                op.future.set_exception(e)
+            return
+        failed = None
+        for op in batch:
+            try:
+                mark = _db.touch_mark()
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = op.fn()
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    _db.discard_touched(mark)
+                    outcomes.append((False, e))
+                else:
+                    conn.execute("RELEASE op")
+                    outcomes.append((True, result))
+            except sqlite3.Error as e:
+                # The batch transaction itself is gone (e.g. disk full); nothing of it survives
+                failed = e
+                break
+        if failed is None:
+            try:
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                failed = e
+        if failed is not None:
+            if conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            _db.discard_touched()
+            outcomes = [(False, failed)] * len(batch)
+        else:
+            # Listeners see the batch before any caller is told it succeeded
+            _db.publish_touched()
+        done = time.perf_counter()
+        for op, (ok, value) in zip(batch, outcomes):
+            if ok:
+                op.future.set_result(value)
+            else:
+                op.future.set_exception(value)
+            self.latencies.append(done - op.queued_at)
+        self.batch_sizes.append(len(batch))
+
+    def latency_stats(self) -> dict:
+        """p50 / p99 queue->commit latency in ms and mean batch size over recent writes."""
+        lat = sorted(self.latencies)
+        sizes = list(self.batch_sizes)
+        if not lat:
+            return {"p50_ms": 0.0, "p99_ms": 0.0, "batch": 0.0}
+        return {
+            "p50_ms": lat[len(lat) // 2] * 1000,
+            "p99_ms": lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000,
+            "batch": sum(sizes) / len(sizes) if sizes else 0.0,
+        }
+
+
+class AsyncDB:
+    """
+    Awaitable facade over the helpers in this module, so SQLite never runs on the event loop.
+    Writes go through the GroupCommitWriter (one writer thread, batched commits); reads use a
+    small pool of reader threads (each with its own pooled connection, WAL lets them run
+    beside the writer).
+
+        rows = await adb.read(get_clock_times, user_id, date)
+        await adb.write(add_clock_in, user_id, date, clock_in)
+        await adb.write_exclusive(checkpoint_and_vacuum)   # cannot run inside a transaction
+    """
+    def __init__(self, readers: int = 4):
+        self.writer = GroupCommitWriter()
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+    async def read(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(fn, *args, **kwargs))
+
+    async def write(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.writer.submit(functools.partial(fn, *args, **kwargs)))
+
+    async def write_exclusive(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.writer.submit(functools.partial(fn, *args, **kwargs), exclusive=True))
+
+    def write_blocking(self, fn, *args, **kwargs):
+        """write() for worker threads (never the event loop): queue on the writer and wait for the commit."""
+        return self.writer.submit(functools.partial(fn, *args, **kwargs)).result()
+
+    def shutdown(self) -> None:
+        self.writer.stop()
+        self._readers.shutdown(wait=True)
+
+
+adb = AsyncDB()
+
 
 def init_db():
-    conn = sqlite3.connect('clock_times.db')
+    conn = _db.get()
     c = conn.cursor()
+    # Base (v0) schema; since v3 clock_times / clock_times_sas are views over sessions
     c.execute('''CREATE TABLE IF NOT EXISTS clock_times (
                  user_id INTEGER,
                  date TEXT,
@@ -20,166 +401,761 @@ def init_db():
             clock_out TEXT
         )
     """)
+    # WAL / auto_vacuum / checkpoint limits are applied per connection (CONNECTION_PRAGMAS)
+    # Sessions from before v2 get their epochs from backfill_epochs(), run once the bot is up
+    _apply_migrations(conn)
+
+
+# ---------- Schema migrations ----------
+# Each step runs once, in its own transaction, and bumps PRAGMA user_version.
+
+def _migrate_v1(c: sqlite3.Connection) -> None:
+    # Hot lookups filter on (user_id, date) and order by clock_in
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clock_times_user_date ON clock_times (user_id, date, clock_in)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clock_times_sas_user_date ON clock_times_sas (user_id, date, clock_in)")
+    # Open sessions are a tiny subset of history; keep them in partial indexes
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clock_times_open ON clock_times (clock_in, user_id, date) WHERE clock_out IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clock_times_sas_open ON clock_times_sas (clock_in, user_id, date) WHERE clock_out IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clock_times_open_user ON clock_times (user_id, clock_in) WHERE clock_out IS NULL")
+
+def _migrate_v2(c: sqlite3.Connection) -> None:
+    # Epoch instants + precomputed duration (minutes); rows are backfilled by backfill_epochs()
+    for table in ("clock_times", "clock_times_sas"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN start_ts INTEGER")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN end_ts INTEGER")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN duration INTEGER")
+
+def _migrate_v3(c: sqlite3.Connection) -> None:
+    # One sessions table for every department; the old per-department tables become views
+    c.execute("""
+        CREATE TABLE sessions (
+            id INTEGER PRIMARY KEY,
+            dept TEXT NOT NULL,
+            user_id INTEGER,
+            date TEXT,
+            clock_in TEXT,
+            clock_out TEXT,
+            start_ts INTEGER,
+            end_ts INTEGER,
+            duration INTEGER
+        )
+    """)
+    for dept, table in ((DEPT_PD, "clock_times"), (DEPT_SAS, "clock_times_sas")):
+        c.execute(
+            f"INSERT INTO sessions (dept, user_id, date, clock_in, clock_out, start_ts, end_ts, duration) "
+            f"SELECT ?, user_id, date, clock_in, clock_out, start_ts, end_ts, duration FROM {table} ORDER BY rowid",
+            (dept,)
+        )
+        c.execute(f"DROP TABLE {table}")
+        c.execute(
+            f"CREATE VIEW {table} AS SELECT user_id, date, clock_in, clock_out, start_ts, end_ts, duration "
+            f"FROM sessions WHERE dept = '{dept}'"
+        )
+    c.execute("CREATE INDEX idx_sessions_user_date ON sessions (dept, user_id, date, clock_in)")
+    c.execute("CREATE INDEX idx_sessions_open ON sessions (clock_in, dept, user_id, date) WHERE clock_out IS NULL")
+    c.execute("CREATE INDEX idx_sessions_open_user ON sessions (dept, user_id, clock_in) WHERE clock_out IS NULL")
+
+# daily_totals keeps per user/department/day the sum of positive session minutes and how
+# many sessions made it up. Triggers on sessions update it inside the writer's own
+# transaction, so it can never drift from the raw rows (rebuild_daily_totals() re-derives it).
+_DAILY_TOTALS_ADD = """
+    INSERT INTO daily_totals (dept, user_id, date, minutes, sessions)
+    VALUES (NEW.dept, NEW.user_id, NEW.date, NEW.duration, 1)
+    ON CONFLICT (dept, user_id, date) DO UPDATE SET
+        minutes = minutes + excluded.minutes,
+        sessions = sessions + 1;
+"""
+_DAILY_TOTALS_SUB = """
+    UPDATE daily_totals SET minutes = minutes - OLD.duration, sessions = sessions - 1
+    WHERE dept = OLD.dept AND user_id = OLD.user_id AND date = OLD.date;
+    DELETE FROM daily_totals
+    WHERE dept = OLD.dept AND user_id = OLD.user_id AND date = OLD.date AND sessions <= 0;
+"""
+
+def _migrate_v4(c: sqlite3.Connection) -> None:
+    c.execute("""
+        CREATE TABLE daily_totals (
+            dept TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dept, user_id, date)
+        ) WITHOUT ROWID
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_sessions_totals_ins AFTER INSERT ON sessions
+        WHEN NEW.duration > 0
+        BEGIN {_DAILY_TOTALS_ADD} END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_sessions_totals_del AFTER DELETE ON sessions
+        WHEN OLD.duration > 0
+        BEGIN {_DAILY_TOTALS_SUB} END
+    """)
+    # An update is "remove the old row, add the new one"
+    c.execute(f"""
+        CREATE TRIGGER trg_sessions_totals_upd_old AFTER UPDATE OF dept, user_id, date, duration ON sessions
+        WHEN OLD.duration > 0
+        BEGIN {_DAILY_TOTALS_SUB} END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_sessions_totals_upd_new AFTER UPDATE OF dept, user_id, date, duration ON sessions
+        WHEN NEW.duration > 0
+        BEGIN {_DAILY_TOTALS_ADD} END
+    """)
+    _fill_daily_totals(c)
+
+def _legacy_punish_counts() -> list[tuple[int, int]]:
+    if not os.path.exists(PUNISH_DB_PATH):
+        return []
+    old = sqlite3.connect(PUNISH_DB_PATH)
+    try:
+        return old.execute("SELECT user_id, count FROM punishments WHERE user_id IS NOT NULL").fetchall()
+    except sqlite3.DatabaseError:
+        return []
+    finally:
+        old.close()
+
+def _migrate_v5(c: sqlite3.Connection) -> None:
+    # Warn counters move into the main DB (one connection, atomic UPSERT) with an event log
+    c.execute("CREATE TABLE punishments (user_id INTEGER PRIMARY KEY, count INTEGER NOT NULL DEFAULT 0)")
+    c.execute("""
+        CREATE TABLE warn_events (
+            id INTEGER PRIMARY KEY,
+            target_id INTEGER NOT NULL,
+            actor_id INTEGER,
+            kind TEXT NOT NULL,
+            reason TEXT,
+            ts INTEGER NOT NULL
+        )
+    """)
+    c.execute("CREATE INDEX idx_warn_events_target ON warn_events (target_id, ts)")
+    c.executemany(
+        "INSERT INTO punishments (user_id, count) VALUES (?, ?)",
+        [(uid, min(max(count or 0, 0), WARN_LIMIT)) for uid, count in _legacy_punish_counts()]
+    )
+
+def _migrate_v6(c: sqlite3.Connection) -> None:
+    # Staffing analytics read sessions by time span, not by member
+    c.execute("CREATE INDEX idx_sessions_span ON sessions (dept, start_ts, end_ts)")
+
+def _migrate_v7(c: sqlite3.Connection) -> None:
+    # Leaderboards read one dept's date range across all members; covering, so no table lookups
+    c.execute("CREATE INDEX idx_daily_totals_date ON daily_totals (dept, date, user_id, minutes)")
+
+def _migrate_v8(c: sqlite3.Connection) -> None:
+    # Where each department's live on-duty dashboard message lives
+    c.execute("""
+        CREATE TABLE dashboards (
+            dept TEXT PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL
+        )
+    """)
+
+def _migrate_v9(c: sqlite3.Connection) -> None:
+    # Pending Google Sheets writes (write-behind); one row per target range, last write wins
+    c.execute("""
+        CREATE TABLE sheets_outbox (
+            id INTEGER PRIMARY KEY,
+            spreadsheet_id TEXT NOT NULL,
+            range TEXT NOT NULL,
+            values_json TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_try_ts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            UNIQUE (spreadsheet_id, range)
+        )
+    """)
+
+def _migrate_v10(c: sqlite3.Connection) -> None:
+    # Range exports seek the month per department instead of walking idx_sessions_user_date
+    c.execute("CREATE INDEX idx_sessions_date ON sessions (dept, date)")
+
+def _migrate_v11(c: sqlite3.Connection) -> None:
+    # Sheets writes the API rejected for good are kept aside (dead letters) instead of retried
+    c.execute("ALTER TABLE sheets_outbox ADD COLUMN failed_ts INTEGER")
+
+def _migrate_v12(c: sqlite3.Connection) -> None:
+    # Small key/value store for one-off maintenance state (e.g. a finished backfill)
+    c.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+    (6, _migrate_v6),
+    (7, _migrate_v7),
+    (8, _migrate_v8),
+    (9, _migrate_v9),
+    (10, _migrate_v10),
+    (11, _migrate_v11),
+    (12, _migrate_v12),
+]
+
+def schema_version() -> int:
+    return _db.get().execute("PRAGMA user_version").fetchone()[0]
+
+def _apply_migrations(conn: sqlite3.Connection) -> None:
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        with _db.transaction() as c:
+            step(c)
+            c.execute(f"PRAGMA user_version = {version}")
+        logging.info("DB schema migrated to v%s", version)
     try:
-        c.execute("PRAGMA journal_mode=WAL;")
-        c.execute("PRAGMA synchronous=NORMAL;")
-        c.execute("PRAGMA wal_autocheckpoint=1000;")      # checkpoint roughly every ~1k pages
-        c.execute("PRAGMA journal_size_limit=10485760;")   # cap WAL to ~10 MB
-        c.execute("PRAGMA temp_store=MEMORY;")             # avoid /tmp writes
-        c.execute("PRAGMA auto_vacuum=INCREMENTAL;")
-    except Exception:
+        conn.execute("PRAGMA optimize;")
+    except sqlite3.DatabaseError:
         pass
-    conn.commit()
-    conn.close()
 
+def get_meta(key: str) -> str | None:
+    row = _db.get().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_meta(key: str, value: str) -> None:
+    with _db.transaction() as c:
+        c.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+_BACKFILL_BATCH = 500
+_BACKFILL_DONE = "epochs_backfilled"
+
+def _backfill_epochs_step(after_id: int) -> tuple[int | None, int]:
+    """
+    One backfill batch: fill start_ts / end_ts / duration for up to _BACKFILL_BATCH sessions
+    written before schema v2 with id > after_id; rows whose TEXT values cannot be parsed are skipped.
+    Returns (id to continue after, rows updated). The id is None once no rows are left, and the
+    finished run is recorded in meta.
+    """
+    with _db.transaction() as c:
+        rows = c.execute(
+            "SELECT id, date, clock_in, clock_out FROM sessions "
+            "WHERE id > ? AND start_ts IS NULL AND clock_in IS NOT NULL ORDER BY id LIMIT ?",
+            (after_id, _BACKFILL_BATCH)
+        ).fetchall()
+        if not rows:
+            set_meta(_BACKFILL_DONE, str(int(time.time())))
+            return None, 0
+        updates = []
+        for rowid, date, ci, co in rows:
+            try:
+                start_ts = to_epoch(date, ci)
+                end_ts = to_epoch(date, co) if co else None
+            except (TypeError, ValueError):
+                continue
+            updates.append((start_ts, end_ts, session_minutes(start_ts, end_ts), rowid))
+        c.executemany("UPDATE sessions SET start_ts = ?, end_ts = ?, duration = ? WHERE id = ?", updates)
+        return rows[-1][0], len(updates)
+
+async def backfill_epochs() -> int:
+    """
+    Backfill the epochs of sessions written before schema v2, one batch per writer op so
+    clicks queued behind it wait for at most one batch. Skipped once a run has finished.
+    Returns the number of rows updated.
+    """
+    if await adb.read(get_meta, _BACKFILL_DONE) is not None:
+        return 0
+    done, after = 0, 0
+    while after is not None:
+        after, updated = await adb.write(_backfill_epochs_step, after)
+        done += updated
+    return done
+
+def _fill_daily_totals(c: sqlite3.Connection) -> None:
+    c.execute("DELETE FROM daily_totals")
+    c.execute(
+        "INSERT INTO daily_totals (dept, user_id, date, minutes, sessions) "
+        "SELECT dept, user_id, date, SUM(duration), COUNT(*) FROM sessions "
+        "WHERE duration > 0 AND user_id IS NOT NULL AND date IS NOT NULL "
+        "GROUP BY dept, user_id, date"
+    )
+
+def rebuild_daily_totals() -> int:
+    """Re-derive daily_totals from the raw sessions in one transaction. Returns the row count."""
+    with _db.transaction() as c:
+        _fill_daily_totals(c)
+        _db.touch(ALL_CHANGED)
+        return c.execute("SELECT COUNT(*) FROM daily_totals").fetchone()[0]
+
+# SQL of the click / report path helpers below. They live here so HOT_QUERIES checks the
+# statements the helpers really run; {marks} is filled with one "?" per id of an IN list.
+_DEPT_MARKS = ", ".join("?" * len(DEPARTMENTS))
+_SQL_CLOCK_TIMES = "SELECT clock_in, clock_out, duration FROM sessions WHERE dept = ? AND user_id = ? AND date = ? ORDER BY clock_in"
+_SQL_OPEN_SESSION_START = ("SELECT clock_in FROM sessions WHERE dept = ? AND user_id = ? AND date = ? AND clock_out IS NULL "
+                           "ORDER BY clock_in LIMIT 1")
+_SQL_CLOSE_SESSION_AT = ("UPDATE sessions SET clock_out = ?, end_ts = ?, duration = session_minutes(start_ts, ?) "
+                         "WHERE dept = ? AND user_id = ? AND date = ? AND clock_in = ?")
+_SQL_CLOSE_OPEN_SESSION = ("UPDATE sessions SET clock_out = ?, end_ts = ?, duration = session_minutes(start_ts, ?) "
+                           "WHERE dept = ? AND user_id = ? AND date = ? AND clock_out IS NULL")
+_SQL_SESSION_DURATION = "SELECT duration FROM sessions WHERE dept = ? AND user_id = ? AND date = ? AND clock_in = ?"
+_SQL_DELETE_SESSION = "DELETE FROM sessions WHERE dept = ? AND user_id = ? AND date = ? AND clock_in = ?"
+_SQL_ONGOING = "SELECT user_id, date, clock_in FROM sessions WHERE dept = ? AND clock_out IS NULL ORDER BY clock_in"
+_SQL_ONGOING_USER = "SELECT user_id, date, clock_in FROM sessions WHERE dept = ? AND user_id = ? AND clock_out IS NULL ORDER BY clock_in"
+_SQL_ONGOING_ALL = ("SELECT dept, user_id, date, clock_in FROM sessions INDEXED BY idx_sessions_open_user "
+                    f"WHERE dept IN ({_DEPT_MARKS}) AND clock_out IS NULL ORDER BY clock_in")
+_SQL_ONGOING_ALL_DATE = ("SELECT dept, user_id, date, clock_in FROM sessions INDEXED BY idx_sessions_open_user "
+                         f"WHERE dept IN ({_DEPT_MARKS}) AND clock_out IS NULL AND date = ? ORDER BY clock_in")
+_SQL_SESSIONS_RANGE = ("SELECT user_id, date, clock_in, clock_out, duration FROM sessions "
+                       "WHERE dept = ? AND user_id IN ({marks}) AND date BETWEEN ? AND ? ORDER BY user_id, date, clock_in")
+_SQL_MINUTES_RANGE = "SELECT user_id, date, minutes FROM daily_totals WHERE dept = ? AND user_id IN ({marks}) AND date BETWEEN ? AND ?"
+_SQL_SESSIONS_EXPORT = ("SELECT dept, user_id, date, clock_in, clock_out, duration FROM sessions INDEXED BY idx_sessions_date "
+                        "WHERE dept IN ({marks}) AND date BETWEEN ? AND ? ORDER BY dept, user_id, date, clock_in")
+_SQL_LEADERBOARD = (
+    "SELECT rnk, user_id, total FROM ("
+    "  SELECT user_id, SUM(minutes) AS total, RANK() OVER (ORDER BY SUM(minutes) DESC) AS rnk"
+    "  FROM daily_totals INDEXED BY idx_daily_totals_date WHERE dept = ? AND date BETWEEN ? AND ?"
+    "  GROUP BY user_id HAVING total > 0"
+    ") WHERE rnk <= ? ORDER BY rnk, user_id"
+)
+_SQL_SESSION_SPANS = ("SELECT start_ts, end_ts FROM sessions "
+                      "WHERE dept = ? AND start_ts >= ? AND start_ts < ? AND (end_ts IS NULL OR end_ts > ?)")
+_SQL_WARN_HISTORY = "SELECT kind, actor_id, reason, ts FROM warn_events WHERE target_id = ? ORDER BY ts DESC, id DESC LIMIT ?"
+
+# None of them may fall back to a full table scan (checked by tests/test_query_plans.py).
+HOT_QUERIES = (
+    (_SQL_CLOCK_TIMES, ("", 0, "")),
+    (_SQL_OPEN_SESSION_START, ("", 0, "")),
+    (_SQL_CLOSE_SESSION_AT, ("", 0, 0, "", 0, "", "")),
+    (_SQL_CLOSE_OPEN_SESSION, ("", 0, 0, "", 0, "")),
+    (_SQL_SESSION_DURATION, ("", 0, "", "")),
+    (_SQL_DELETE_SESSION, ("", 0, "", "")),
+    (_SQL_ONGOING, ("",)),
+    (_SQL_ONGOING_USER, ("", 0)),
+    (_SQL_ONGOING_ALL, DEPARTMENTS),
+    (_SQL_ONGOING_ALL_DATE, (*DEPARTMENTS, "")),
+    (_SQL_SESSIONS_RANGE.format(marks="?, ?"), ("", 0, 0, "", "")),
+    (_SQL_MINUTES_RANGE.format(marks="?, ?"), ("", 0, 0, "", "")),
+    (_SQL_SESSIONS_EXPORT.format(marks=_DEPT_MARKS), (*DEPARTMENTS, "", "")),
+    (_SQL_LEADERBOARD, ("", "", "", 10)),
+    (_SQL_SESSION_SPANS, ("", 0, 0, 0)),
+    (_SQL_WARN_HISTORY, (0, 10)),
+)
+
+
+def explain_query_plan(sql: str, params: tuple = ()) -> list[str]:
+    rows = _db.get().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [r[-1] for r in rows]
+
+
+# ---------- Maintenance ----------
+# Everything here is small and restartable so it can be interleaved with normal writes:
+# vacuum steps go through adb.write_exclusive() one batch at a time, backups read a
+# snapshot on a reader thread (WAL readers never block the writer).
+MAINT_VACUUM_PAGES = 256
+BACKUP_DIR = 'backups'
+BACKUP_PAGES = 256
+BACKUP_KEEP = 5
 
 def checkpoint_and_vacuum() -> None:
-    conn = sqlite3.connect('clock_times.db')
+    """Full rewrite of the file; only needed once to switch an old DB to auto_vacuum=INCREMENTAL."""
+    conn = _db.get()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    conn.execute("VACUUM;")
+
+def auto_vacuum_mode() -> int:
+    """0 = NONE, 1 = FULL, 2 = INCREMENTAL (incremental_vacuum only works in mode 2)."""
+    return _db.get().execute("PRAGMA auto_vacuum").fetchone()[0]
+
+def wal_checkpoint(mode: str = "PASSIVE") -> tuple[int, int, int]:
+    """(busy, wal_frames, checkpointed_frames); PASSIVE never waits for readers or writers."""
+    return tuple(_db.get().execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+def freelist_pages() -> int:
+    return _db.get().execute("PRAGMA freelist_count").fetchone()[0]
+
+def incremental_vacuum_step(pages: int = MAINT_VACUUM_PAGES) -> int:
+    """Return up to `pages` free pages to the OS. Returns the free pages left."""
+    conn = _db.get()
+    # The pragma frees one page per sqlite3_step(); execute() steps only once, executescript() runs it to completion
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return freelist_pages()
+
+def reclaim_space() -> int:
+    """
+    Quick disk-full recovery: truncate the WAL and drop every free page. Returns pages left.
+    A file not yet in auto_vacuum=INCREMENTAL mode (incremental_vacuum is a no-op there) gets
+    the full VACUUM instead, which also converts it.
+    """
+    if auto_vacuum_mode() != 2:
+        checkpoint_and_vacuum()
+        return freelist_pages()
+    wal_checkpoint("TRUNCATE")
+    return incremental_vacuum_step(0)  # 0 = the whole freelist
+
+def backup_database(dest_path: str | None = None, progress=None, pages: int = BACKUP_PAGES) -> str:
+    """
+    Online snapshot of DB_PATH through the sqlite3 backup API, copied `pages` at a time.
+    progress(remaining, total) is called after each step (from the calling thread).
+    Old snapshots beyond BACKUP_KEEP are removed. Returns the snapshot path.
+    """
+    if dest_path is None:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        dest_path = os.path.join(BACKUP_DIR, f"clock_times-{stamp}.db")
+    tmp_path = dest_path + ".part"
+    src = sqlite3.connect(DB_PATH)
+    dst = sqlite3.connect(tmp_path)
     try:
-        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
-        conn.execute("VACUUM;")
+        src.execute("PRAGMA busy_timeout=5000")
+        src.backup(dst, pages=pages, progress=(lambda status, remaining, total: progress(remaining, total)) if progress else None)
     finally:
-        conn.close()
+        dst.close()
+        src.close()
+    os.replace(tmp_path, dest_path)
+    if os.path.dirname(dest_path) == BACKUP_DIR:
+        snapshots = sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith("clock_times-") and f.endswith(".db"))
+        for old in snapshots[:-BACKUP_KEEP]:
+            try:
+                os.remove(os.path.join(BACKUP_DIR, old))
+            except OSError:
+                pass
+    return dest_path
 
 def db_stats() -> str:
     try:
-        conn = sqlite3.connect('clock_times.db')
-        cur = conn.cursor()
+        cur = _db.get().cursor()
         cur.execute("PRAGMA page_count"); pages = cur.fetchone()[0]
         cur.execute("PRAGMA page_size"); psize = cur.fetchone()[0]
         cur.execute("PRAGMA freelist_count"); freep = cur.fetchone()[0]
-        conn.close()
         size = pages * psize
         free = freep * psize
-        return f"size={size}B free={free}B page_size={psize}"
+        lat = adb.writer.latency_stats()
+        cur.execute("SELECT COUNT(*), COUNT(failed_ts) FROM sheets_outbox"); outbox, failed = cur.fetchone()
+        return (f"size={size}B free={free}B page_size={psize} schema=v{schema_version()} "
+                f"write_p50={lat['p50_ms']:.1f}ms write_p99={lat['p99_ms']:.1f}ms batch={lat['batch']:.1f} "
+                f"sheets_outbox={outbox - failed} sheets_failed={failed}")
     except Exception as e:
         return f"stats_error:{e}"
 
-def add_clock_in(user_id, date, clock_in):
-    conn = sqlite3.connect('clock_times.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO clock_times (user_id, date, clock_in, clock_out) VALUES (?, ?, ?, ?)",
-              (user_id, date, clock_in, None))
-    conn.commit()
-    conn.close()
+# ---------- Sessions (all departments) ----------
+def add_clock_in(user_id, date, clock_in, dept: str = DEPT_PD):
+    with _db.transaction() as c:
+        c.execute("INSERT INTO sessions (dept, user_id, date, clock_in, clock_out, start_ts) VALUES (?, ?, ?, ?, ?, ?)",
+                  (dept, user_id, date, clock_in, None, to_epoch(date, clock_in)))
+        _db.touch((dept, user_id, date))
 
-def update_clock_out(user_id, date, clock_out, start_time: str | None = None):
-    conn = sqlite3.connect('clock_times.db')
-    c = conn.cursor()
-    if start_time:
-        # Close only the session that started at start_time
-        c.execute(
-            "UPDATE clock_times SET clock_out = ? WHERE user_id = ? AND date = ? AND clock_in = ?",
-            (clock_out, user_id, date, start_time)
-        )
+def add_closed_session(user_id, date, clock_in, clock_out, dept: str = DEPT_PD):
+    """Insert an already finished session (manual minutes) as one row, in one transaction."""
+    start_ts = to_epoch(date, clock_in)
+    end_ts = to_epoch(date, clock_out)
+    with _db.transaction() as c:
+        c.execute("INSERT INTO sessions (dept, user_id, date, clock_in, clock_out, start_ts, end_ts, duration) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, session_minutes(?, ?))",
+                  (dept, user_id, date, clock_in, clock_out, start_ts, end_ts, start_ts, end_ts))
+        _db.touch((dept, user_id, date))
+
+def _open_session_start(c: sqlite3.Connection, user_id, date, dept: str) -> str | None:
+    row = c.execute(_SQL_OPEN_SESSION_START, (dept, user_id, date)).fetchone()
+    return row[0] if row else None
+
+def try_clock_in(user_id, date, clock_in, dept: str = DEPT_PD) -> str | None:
+    """
+    Open a session unless the user already has one open that day; check and insert share one
+    transaction, so concurrent clicks cannot both insert. Returns the open session's clock_in
+    if there was one (nothing inserted), else None.
+    """
+    with _db.transaction() as c:
+        existing = _open_session_start(c, user_id, date, dept)
+        if existing is None:
+            add_clock_in(user_id, date, clock_in, dept=dept)
+        return existing
+
+def try_clock_out(user_id, date, clock_out, dept: str = DEPT_PD) -> tuple[str, int | None] | None:
+    """
+    Close the user's open session of that day in one transaction.
+    Returns (clock_in, stored duration in minutes), or None if no session was open.
+    """
+    with _db.transaction() as c:
+        start = _open_session_start(c, user_id, date, dept)
+        if start is None:
+            return None
+        return start, update_clock_out(user_id, date, clock_out, start, dept=dept)
+
+def update_clock_out(user_id, date, clock_out, start_time: str | None = None, dept: str = DEPT_PD) -> int | None:
+    """
+    Close a session; with start_time, returns its stored duration (elapsed minutes, rounded
+    to 5; differs from the wall-clock difference across a DST change). Legacy calls return None.
+    """
+    end_ts = to_epoch(date, clock_out)
+    with _db.transaction() as c:
+        if start_time:
+            # Close only the session that started at start_time
+            c.execute(
+                _SQL_CLOSE_SESSION_AT,
+                (clock_out, end_ts, end_ts, dept, user_id, date, start_time)
+            )
+        else:
+            # Legacy: close the most recent open session
+            c.execute(
+                _SQL_CLOSE_OPEN_SESSION,
+                (clock_out, end_ts, end_ts, dept, user_id, date)
+            )
+        _db.touch((dept, user_id, date))
+        if start_time:
+            row = c.execute(_SQL_SESSION_DURATION, (dept, user_id, date, start_time)).fetchone()
+            return row[0] if row else None
+        return None
+
+def get_clock_times(user_id, date, dept: str = DEPT_PD):
+    # (clock_in, clock_out, duration) - duration is the rounded minutes, NULL while open
+    c = _db.get().execute(_SQL_CLOCK_TIMES, (dept, user_id, date))
+    return c.fetchall()
+
+def get_ongoing_sessions(user_id=None, dept: str = DEPT_PD):
+    conn = _db.get()
+    if user_id:
+        c = conn.execute(_SQL_ONGOING_USER, (dept, user_id))
+    else:
+        c = conn.execute(_SQL_ONGOING, (dept,))
+    return c.fetchall()
+
+def get_ongoing_sessions_all(date: str | None = None):
+    """
+    Open sessions of every department in one query: [(dept, user_id, date, clock_in), ...].
+    Seeks each department in the open-sessions index instead of scanning it.
+    """
+    conn = _db.get()
+    if date:
+        c = conn.execute(_SQL_ONGOING_ALL_DATE, (*DEPARTMENTS, date))
     else:
-        # Legacy: close the most recent open session
+        c = conn.execute(_SQL_ONGOING_ALL, DEPARTMENTS)
+    return c.fetchall()
+
+def remove_session(user_id, date, clock_in, dept: str = DEPT_PD):
+    with _db.transaction() as c:
+        c.execute(_SQL_DELETE_SESSION, (dept, user_id, date, clock_in))
+        _db.touch((dept, user_id, date))
+
+# ---------- Bulk range reads (reports) ----------
+# SQLite caps host parameters per statement; stay well below the old 999 limit.
+_IN_CHUNK = 900
+
+def get_sessions_range(user_ids, date_from: str, date_to: str, dept: str = DEPT_PD) -> dict[int, dict[str, list[tuple]]]:
+    """
+    All sessions of user_ids with date_from <= date <= date_to, grouped as
+    {user_id: {date: [(clock_in, clock_out, duration), ...]}} (ordered by clock_in).
+    One indexed query per chunk of user ids instead of one query per user per day.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    out: dict[int, dict[str, list[tuple]]] = {}
+    conn = _db.get()
+    for i in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[i:i + _IN_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        c = conn.execute(_SQL_SESSIONS_RANGE.format(marks=marks), (dept, *chunk, date_from, date_to))
+        for uid, date, ci, co, duration in c:
+            out.setdefault(uid, {}).setdefault(date, []).append((ci, co, duration))
+    return out
+
+def get_minutes_range(user_ids, date_from: str, date_to: str, dept: str = DEPT_PD) -> dict[int, dict[str, int]]:
+    """
+    Positive session minutes per user and day, read from the daily_totals rollup:
+    {user_id: {date: minutes}}. Days without closed sessions are omitted.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    out: dict[int, dict[str, int]] = {}
+    conn = _db.get()
+    for i in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[i:i + _IN_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        c = conn.execute(_SQL_MINUTES_RANGE.format(marks=marks), (dept, *chunk, date_from, date_to))
+        for uid, date, minutes in c:
+            out.setdefault(uid, {})[date] = minutes
+    return out
+
+def get_minutes_columns(user_ids, date_from: str, date_to: str, dept: str = DEPT_PD) -> tuple[list[int], list[str], list[int]]:
+    """
+    Same rows as get_minutes_range() but columnar: three parallel lists (user_id, date, minutes),
+    for reports that aggregate many members x days in one pass.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    uids: list[int] = []
+    dates: list[str] = []
+    minutes: list[int] = []
+    conn = _db.get()
+    for i in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[i:i + _IN_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        c = conn.execute(_SQL_MINUTES_RANGE.format(marks=marks), (dept, *chunk, date_from, date_to))
+        for uid, date, mins in c:
+            uids.append(uid)
+            dates.append(date)
+            minutes.append(mins)
+    return uids, dates, minutes
+
+def iter_sessions_range(date_from: str, date_to: str, dept: str | None = None):
+    """
+    Streams (dept, user_id, date, clock_in, clock_out, duration) for every session in the range,
+    ordered by dept, user_id, date, clock_in. Each department is a seek on idx_sessions_date,
+    so only the range's rows are read (and sorted); dept=None covers every department.
+    Must be consumed on the thread that created it (a reader thread via adb.read).
+    """
+    depts = (dept,) if dept else DEPARTMENTS
+    c = _db.get().execute(_SQL_SESSIONS_EXPORT.format(marks=", ".join("?" * len(depts))), (*depts, date_from, date_to))
+    try:
+        yield from c
+    finally:
+        c.close()
+
+def get_leaderboard(date_from: str, date_to: str, dept: str = DEPT_PD, limit: int = 10) -> list[tuple[int, int, int]]:
+    """
+    Top members by minutes in the range, ranked inside SQLite: [(rank, user_id, minutes)].
+    Ties share a rank (RANK()), so a tie at the cut-off may return a few more than `limit` rows.
+    The index is pinned: without ANALYZE stats the planner prefers walking the primary key
+    (it already groups by user_id) over the date range.
+    """
+    return _db.get().execute(_SQL_LEADERBOARD, (dept, date_from, date_to, limit)).fetchall()
+
+SPAN_LOOKBACK = 2 * 86400  # sessions older than this at the window start are assumed closed by the sweeps
+
+def get_session_spans(ts_from: int, ts_to: int, dept: str = DEPT_PD) -> tuple[list[int], list[int | None]]:
+    """
+    (start_ts, end_ts) of every session overlapping [ts_from, ts_to) as two parallel lists;
+    end is None for sessions still open. Reads only idx_sessions_span.
+    """
+    c = _db.get().execute(
+        _SQL_SESSION_SPANS,
+        (dept, ts_from - SPAN_LOOKBACK, ts_to, ts_from)
+    )
+    starts: list[int] = []
+    ends: list[int | None] = []
+    for start, end in c:
+        starts.append(start)
+        ends.append(end)
+    return starts, ends
+
+# ---------- Dashboards ----------
+def get_dashboards() -> dict[str, tuple[int, int]]:
+    """dept -> (channel_id, message_id) of the live dashboard messages."""
+    rows = _db.get().execute("SELECT dept, channel_id, message_id FROM dashboards").fetchall()
+    return {dept: (channel_id, message_id) for dept, channel_id, message_id in rows}
+
+def set_dashboard(dept: str, channel_id: int, message_id: int) -> None:
+    with _db.transaction() as c:
         c.execute(
-            "UPDATE clock_times SET clock_out = ? WHERE user_id = ? AND date = ? AND clock_out IS NULL",
-            (clock_out, user_id, date)
+            "INSERT INTO dashboards (dept, channel_id, message_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(dept) DO UPDATE SET channel_id = excluded.channel_id, message_id = excluded.message_id",
+            (dept, channel_id, message_id)
         )
-    conn.commit()
-    conn.close()
 
-def get_clock_times(user_id, date):
-    conn = sqlite3.connect('clock_times.db')
-    c = conn.cursor()
-    c.execute("SELECT clock_in, clock_out FROM clock_times WHERE user_id = ? AND date = ? ORDER BY clock_in", (user_id, date))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+def remove_dashboard(dept: str) -> None:
+    with _db.transaction() as c:
+        c.execute("DELETE FROM dashboards WHERE dept = ?", (dept,))
 
-def get_ongoing_sessions(user_id=None):
-    conn = sqlite3.connect('clock_times.db')
-    c = conn.cursor()
-    if user_id:
-        c.execute("SELECT user_id, date, clock_in FROM clock_times WHERE user_id = ? AND clock_out IS NULL ORDER BY clock_in", (user_id,))
-    else:
-        c.execute("SELECT user_id, date, clock_in FROM clock_times WHERE clock_out IS NULL ORDER BY clock_in")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+# ---------- Sheets outbox ----------
+def outbox_put(spreadsheet_id: str, entries: list[tuple[str, str]]) -> None:
+    """
+    Queue (range, values_json) writes. A write to a range that is still pending replaces it
+    (new value, bumped version) and keeps its place and backoff; one to a dead-lettered range
+    replaces the rejected value and is queued again.
+    """
+    with _db.transaction() as c:
+        c.executemany(
+            "INSERT INTO sheets_outbox (spreadsheet_id, range, values_json) VALUES (?, ?, ?) "
+            "ON CONFLICT(spreadsheet_id, range) DO UPDATE SET values_json = excluded.values_json, "
+            "version = version + 1, "
+            "attempts = CASE WHEN failed_ts IS NULL THEN attempts ELSE 0 END, "
+            "next_try_ts = CASE WHEN failed_ts IS NULL THEN next_try_ts ELSE 0 END, "
+            "failed_ts = NULL",
+            [(spreadsheet_id, rng, values_json) for rng, values_json in entries]
+        )
 
-def remove_session(user_id, date, clock_in):
-    conn = sqlite3.connect('clock_times.db')
-    c = conn.cursor()
-    c.execute("DELETE FROM clock_times WHERE user_id = ? AND date = ? AND clock_in = ?", (user_id, date, clock_in))
-    conn.commit()
-    conn.close()
+def outbox_due(now: int) -> list[tuple[int, str, str, str, int, int]]:
+    """(id, spreadsheet_id, range, values_json, version, attempts) of the writes due by `now`, oldest first."""
+    return _db.get().execute(
+        "SELECT id, spreadsheet_id, range, values_json, version, attempts FROM sheets_outbox "
+        "WHERE failed_ts IS NULL AND next_try_ts <= ? ORDER BY id", (now,)
+    ).fetchall()
+
+def outbox_pending(spreadsheet_id: str) -> list[tuple[str, str]]:
+    """(range, values_json) of every write not yet applied to the spreadsheet."""
+    return _db.get().execute(
+        "SELECT range, values_json FROM sheets_outbox WHERE spreadsheet_id = ? AND failed_ts IS NULL ORDER BY id",
+        (spreadsheet_id,)
+    ).fetchall()
+
+def outbox_done(sent: list[tuple[int, int]]) -> None:
+    """Drop the (id, version) writes that were applied; rows rewritten since then stay queued."""
+    with _db.transaction() as c:
+        c.executemany("DELETE FROM sheets_outbox WHERE id = ? AND version = ?", sent)
+
+def outbox_retry(ids: list[int], next_try_ts: int, error: str) -> None:
+    with _db.transaction() as c:
+        c.executemany(
+            "UPDATE sheets_outbox SET attempts = attempts + 1, next_try_ts = ?, last_error = ? WHERE id = ?",
+            [(next_try_ts, error, id_) for id_ in ids]
+        )
+
+def outbox_fail(sent: list[tuple[int, int]], error: str) -> None:
+    """Dead-letter the (id, version) writes the API rejected; a newer write to the range is kept queued."""
+    now = int(time.time())
+    with _db.transaction() as c:
+        c.executemany(
+            "UPDATE sheets_outbox SET failed_ts = ?, last_error = ? WHERE id = ? AND version = ?",
+            [(now, error, id_, version) for id_, version in sent]
+        )
+
+def outbox_failed() -> list[tuple[str, str, str, str, int]]:
+    """(spreadsheet_id, range, values_json, last_error, failed_ts) of the dead-lettered writes, newest first."""
+    return _db.get().execute(
+        "SELECT spreadsheet_id, range, values_json, last_error, failed_ts FROM sheets_outbox "
+        "WHERE failed_ts IS NOT NULL ORDER BY failed_ts DESC"
+    ).fetchall()
+
+def outbox_next_due() -> dict[str, int]:
+    """spreadsheet_id -> earliest next_try_ts of its pending writes."""
+    rows = _db.get().execute(
+        "SELECT spreadsheet_id, MIN(next_try_ts) FROM sheets_outbox WHERE failed_ts IS NULL GROUP BY spreadsheet_id"
+    ).fetchall()
+    return dict(rows)
 
+# ---------- Warns ----------
 def get_punish_count(user_id):
-    conn = sqlite3.connect('punishments.db')
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS punishments (user_id INTEGER PRIMARY KEY, count INTEGER)")
-    cursor.execute("SELECT count FROM punishments WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = _db.get().execute("SELECT count FROM punishments WHERE user_id = ?", (user_id,)).fetchone()
     return result[0] if result else 0
 
-def reset_punish_count(user_id):
-    conn = sqlite3.connect('punishments.db')
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS punishments (user_id INTEGER PRIMARY KEY, count INTEGER)")
-    cursor.execute("UPDATE punishments SET count = 0 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def increment_punish_count(user_id):
-    conn = sqlite3.connect('punishments.db')
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS punishments (user_id INTEGER PRIMARY KEY, count INTEGER)")
-    current_count = get_punish_count(user_id)
-    new_count = current_count + 1
-    cursor.execute("INSERT OR REPLACE INTO punishments (user_id, count) VALUES (?, ?)", (user_id, new_count))
-    conn.commit()
-    conn.close()
-    return new_count
-
-# ---------- SAS clock functions ----------
-def add_clock_in_sas(user_id: int, date: str, clock_in: str):
-    conn = sqlite3.connect('clock_times.db'); cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO clock_times_sas (user_id, date, clock_in, clock_out) VALUES (?, ?, ?, NULL)",
-        (user_id, date, clock_in)
-    )
-    conn.commit(); conn.close()
-
-def update_clock_out_sas(user_id: int, date: str, clock_out: str, start_time: str | None = None):
-    conn = sqlite3.connect('clock_times.db')
-    c = conn.cursor()
-    if start_time:
-        # Close only the session that started at start_time
+def add_warn(actor_id: int, target_id: int, reason: str) -> tuple[int, bool]:
+    """
+    Atomically bump target's warn counter (capped at WARN_LIMIT) and log the event.
+    Returns (count, added); added is False when the target was already at the limit.
+    """
+    with _db.transaction() as c:
+        row = c.execute(
+            "INSERT INTO punishments (user_id, count) VALUES (?, 1) "
+            "ON CONFLICT (user_id) DO UPDATE SET count = count + 1 WHERE count < ? "
+            "RETURNING count",
+            (target_id, WARN_LIMIT)
+        ).fetchone()
+        if row is None:
+            return get_punish_count(target_id), False
         c.execute(
-            "UPDATE clock_times_sas SET clock_out=? WHERE user_id=? AND date=? AND clock_in=?",
-            (clock_out, user_id, date, start_time)
+            "INSERT INTO warn_events (target_id, actor_id, kind, reason, ts) VALUES (?, ?, 'warn', ?, ?)",
+            (target_id, actor_id, reason, int(time.time()))
         )
-    else:
-        # Fallback: close the most recent open session
+        return row[0], True
+
+def reset_punish_count(user_id, actor_id: int | None = None, note: str | None = None):
+    with _db.transaction() as c:
+        c.execute("UPDATE punishments SET count = 0 WHERE user_id = ?", (user_id,))
         c.execute(
-            "UPDATE clock_times_sas SET clock_out=? WHERE user_id=? AND date=? AND clock_out IS NULL",
-            (clock_out, user_id, date)
+            "INSERT INTO warn_events (target_id, actor_id, kind, reason, ts) VALUES (?, ?, 'reset', ?, ?)",
+            (user_id, actor_id, note or None, int(time.time()))
         )
-    conn.commit()
-    conn.close()
-
-def get_clock_times_sas(user_id: int, date: str):
-    conn = sqlite3.connect('clock_times.db'); cur = conn.cursor()
-    cur.execute(
-        "SELECT clock_in, clock_out FROM clock_times_sas WHERE user_id=? AND date=? ORDER BY clock_in",
-        (user_id, date)
-    )
-    rows = cur.fetchall(); conn.close()
-    return rows
 
-def get_ongoing_sessions_sas():
-    conn = sqlite3.connect('clock_times.db'); cur = conn.cursor()
-    cur.execute("SELECT user_id, date, clock_in FROM clock_times_sas WHERE clock_out IS NULL ORDER BY clock_in")
-    rows = cur.fetchall(); conn.close()
-    return rows
+def get_warn_history(target_id: int, limit: int = 10) -> list[tuple]:
+    """Newest first: [(kind, actor_id, reason, ts), ...] with kind 'warn' or 'reset'."""
+    c = _db.get().execute(_SQL_WARN_HISTORY, (target_id, limit))
+    return c.fetchall()
 
-def remove_session_sas(user_id, date, clock_in):
-    conn = sqlite3.connect('clock_times.db')
-    c = conn.cursor()
-    c.execute("DELETE FROM clock_times_sas WHERE user_id = ? AND date = ? AND clock_in = ?", (user_id, date, clock_in))
-    conn.commit()
-    conn.close()
+def get_warn_status(target_id: int, limit: int = 10) -> tuple[int, list[tuple]]:
+    """(count, history) for the status view in one call."""
+    return get_punish_count(target_id), get_warn_history(target_id, limit)
@@ -8,6 +8,8 @@ from dotenv import load_dotenv
 from zoneinfo import ZoneInfo
 import pathlib
 from typing import Dict, Any
+from collections import OrderedDict
+import threading
 from discord.ext import tasks
 import calendar
 import asyncio
@@ -21,15 +23,37 @@ from discord import app_commands
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import io
+import csv
+import gzip
+import shutil
+import tempfile
+import bisect
+import functools
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
 
 from database import (
-    init_db, add_clock_in, update_clock_out, get_clock_times,
-    get_ongoing_sessions, remove_session,
-    increment_punish_count, get_punish_count, reset_punish_count,
-    add_clock_in_sas, update_clock_out_sas, get_clock_times_sas, get_ongoing_sessions_sas, remove_session_sas,
+    init_db, backfill_epochs, update_clock_out, get_clock_times,
+    try_clock_in, try_clock_out, add_closed_session,
+    get_ongoing_sessions, get_ongoing_sessions_all, remove_session,
+    add_warn, reset_punish_count, get_warn_status, WARN_LIMIT,
+    get_sessions_range, get_minutes_range, get_minutes_columns, iter_sessions_range,
+    DEPT_PD, DEPT_SAS,
     checkpoint_and_vacuum,  # <-- add
+    add_write_listener,
+    auto_vacuum_mode, wal_checkpoint, freelist_pages, incremental_vacuum_step, reclaim_space, backup_database,
+    rebuild_daily_totals,
     db_stats,
+    get_session_spans,
+    get_leaderboard,
+    to_epoch, session_minutes,
+    get_dashboards, set_dashboard, remove_dashboard,
+    outbox_put, outbox_due, outbox_pending, outbox_done, outbox_retry, outbox_fail, outbox_failed, outbox_next_due,
+    adb,
 )
+from analytics import staffing_stats, local_day_window
+from reports import ReportPool, render_week_file, render_day_file
 
 # --------------- Environment ---------------
 load_dotenv()
@@ -77,6 +101,7 @@ ACTIVITY_API_SHEET = os.getenv("ACTIVITY_API_SHEET", "RAZII")
 
 CALLSIGN_RE = re.compile(r"\[?S-(\d{1,2})\]?", re.IGNORECASE)
 PD_CALLSIGN_RE = re.compile(r"\[(\d{1,3})\]")  
+PD_BARE_NUMBER_RE = re.compile(r"\b(\d{1,3})\b")  # PD sort fallback, e.g. "001 Name"
 
 GOOGLE_SHEETS_CREDENTIALS_FILE = os.getenv("GOOGLE_SHEETS_CREDENTIALS_FILE")
 PD_SPREADSHEET_ID = os.getenv("PD_SPREADSHEET_ID")
@@ -127,16 +152,26 @@ class DiscordHandler(logging.Handler):
 # --------------- Time ---------------
 
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Bucharest")
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+def _dept(is_sas: bool) -> str:
+    """Department key used by the sessions table."""
+    return DEPT_SAS if is_sas else DEPT_PD
 
 def local_now() -> datetime.datetime:
-    return datetime.datetime.now(ZoneInfo(TIMEZONE))
+    return datetime.datetime.now(LOCAL_TZ)
 
 # (optional) helper to parse stored times as local aware
 def parse_local(date_str: str, time_str: str) -> datetime.datetime:
-    return datetime.datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=ZoneInfo(TIMEZONE))
+    return datetime.datetime.fromisoformat(f"{date_str} {time_str}").replace(tzinfo=LOCAL_TZ)
 
 
 # --------------- DB ---------------
+# Report workers are forked before anything else: the process is still single-threaded and
+# has no SQLite connection open (SQLite handles must not be carried across fork())
+report_pool = ReportPool()
+report_pool.start()
+
 init_db()
 
 # --------------- Logging ---------------
@@ -233,32 +268,254 @@ async def log_command(
                     pass
 
 
+# --------------- Callsigns ---------------
+CALLSIGN_CACHE_SIZE = 4096
+
+class CallsignService:
+    """
+    Parses callsigns out of display names once per (member_id, display_name).
+    Each entry holds the SAS form ("S-07"), the PD form ("203") and the numeric sort keys;
+    a nickname change simply misses (new key), and invalidate() drops the member's old entries.
+    """
+    def __init__(self, max_entries: int = CALLSIGN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple[int, str], tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, member: discord.Member) -> tuple:
+        name = (member.display_name or member.name or "")
+        key = (member.id, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = self._parse(name)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _parse(name: str) -> tuple:
+        sas = pd = None
+        sas_n = pd_n = 10**6  # large default -> goes to end
+        m = CALLSIGN_RE.search(name)
+        if m:
+            num = int(m.group(1))
+            sas_n = num
+            if 1 <= num <= 99:
+                sas = f"S-{num:02d}"
+        m = PD_CALLSIGN_RE.search(name)
+        if m:
+            num = int(m.group(1))
+            if 1 <= num <= 999:
+                pd = m.group(1)  # as-is (e.g., "203", "005")
+        else:
+            # PD fallback: try to catch bare numbers like "001 Name"
+            m = PD_BARE_NUMBER_RE.search(name)
+        if m:
+            pd_n = int(m.group(1))
+        lower = name.lower()
+        return (sas, pd, (sas_n, lower), (pd_n, lower))
+
+    def sas(self, member: discord.Member) -> str | None:
+        return self._lookup(member)[0]
+
+    def pd(self, member: discord.Member) -> str | None:
+        return self._lookup(member)[1]
+
+    def sort_key(self, member: discord.Member, *, is_sas: bool) -> tuple[int, str]:
+        return self._lookup(member)[2 if is_sas else 3]
+
+    def invalidate(self, member_id: int) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == member_id]:
+                del self._entries[key]
+
+    def stats(self) -> str:
+        with self._lock:
+            return f"entries={len(self._entries)} hits={self.hits} misses={self.misses}"
+
+callsigns = CallsignService()
+
+# --------------- Member index ---------------
+class MemberIndex:
+    """
+    In-memory view of the guilds' members kept current from gateway events:
+    role id -> member ids, member id -> role ids, and each member's callsign sort keys.
+    Report member lists become dictionary lookups instead of walking guild.members.
+    Permission checks do not use it: they read the interaction's own member.roles.
+    Each (guild, role) has a version counter that bumps whenever that role's member set
+    or one of its members' display names changes.
+    """
+    def __init__(self):
+        self._role_members: dict[tuple[int, int], set[int]] = {}     # (guild_id, role_id) -> member ids
+        self._member_roles: dict[tuple[int, int], frozenset[int]] = {}  # (guild_id, member_id) -> role ids
+        self._names: dict[tuple[int, int], str] = {}
+        self._sort_keys: dict[tuple[int, int], tuple[tuple, tuple]] = {}  # -> (PD key, SAS key)
+        self._bots: set[int] = set()
+        self._role_versions: dict[tuple[int, int], int] = {}
+        self._sorted: dict[tuple, tuple[tuple, list[int]]] = {}  # memo of sorted member lists
+
+    def rebuild(self, guild: discord.Guild) -> None:
+        for key in [k for k in self._member_roles if k[0] == guild.id]:
+            self._drop(key)
+        for m in guild.members:
+            self.upsert(m)
+        logging.info("Member index built for %s: %d members", guild.name, len(guild.members))
+
+    def upsert(self, member: discord.Member) -> None:
+        key = (member.guild.id, member.id)
+        roles = frozenset(r.id for r in member.roles)
+        name = member.display_name or member.name or ""
+        old_roles = self._member_roles.get(key, frozenset())
+        if key in self._member_roles and old_roles == roles and self._names.get(key) == name:
+            return
+        for rid in old_roles - roles:
+            self._role_members.get((key[0], rid), set()).discard(member.id)
+        for rid in roles - old_roles:
+            self._role_members.setdefault((key[0], rid), set()).add(member.id)
+        self._member_roles[key] = roles
+        self._names[key] = name
+        self._sort_keys[key] = (_callsign_sort_key(member, is_sas=False), _callsign_sort_key(member, is_sas=True))
+        if member.bot:
+            self._bots.add(member.id)
+        self._bump(key[0], old_roles | roles)
+
+    def remove(self, member: discord.Member) -> None:
+        self._drop((member.guild.id, member.id))
+
+    def _drop(self, key: tuple[int, int]) -> None:
+        roles = self._member_roles.pop(key, None)
+        if roles is None:
+            return
+        for rid in roles:
+            self._role_members.get((key[0], rid), set()).discard(key[1])
+        self._names.pop(key, None)
+        self._sort_keys.pop(key, None)
+        self._bump(key[0], roles)
+
+    def _bump(self, guild_id: int, role_ids) -> None:
+        for rid in role_ids:
+            self._role_versions[(guild_id, rid)] = self._role_versions.get((guild_id, rid), 0) + 1
+
+    def version(self, guild: discord.Guild, role_ids: list[int]) -> tuple:
+        return tuple(self._role_versions.get((guild.id, rid), 0) for rid in role_ids)
+
+    def sort_key(self, guild: discord.Guild, member_id: int, *, is_sas: bool) -> tuple:
+        """Callsign sort key with the member id as tie-breaker (total order, usable as a page cursor)."""
+        return (self._sort_keys[(guild.id, member_id)][1 if is_sas else 0], member_id)
+
+    def members(self, guild: discord.Guild, role_ids: list[int], *, is_sas: bool) -> list[discord.Member]:
+        """Non-bot members having any of role_ids, sorted by callsign."""
+        role_ids = list(role_ids)
+        memo_key = (guild.id, tuple(role_ids), is_sas)
+        version = self.version(guild, role_ids)
+        memo = self._sorted.get(memo_key)
+        if memo is None or memo[0] != version:
+            ids = set()
+            for rid in role_ids:
+                ids |= self._role_members.get((guild.id, rid), set())
+            ids -= self._bots
+            ordered = sorted(ids, key=lambda mid: self.sort_key(guild, mid, is_sas=is_sas))
+            memo = self._sorted[memo_key] = (version, ordered)
+        out = []
+        for mid in memo[1]:
+            m = guild.get_member(mid)
+            if m is not None:
+                out.append(m)
+        return out
+
+member_index = MemberIndex()
+
 # --------------- Helpers (report) ---------------
+REPORT_CACHE_BYTES = 16 * 1024 * 1024
+
+class ReportCache:
+    """
+    LRU of rendered reports, capped by (approximate) bytes.
+    Keys are (kind, dept, date_from, date_to, member-set version, ...); each entry also records the
+    user ids it covers, so a DB write drops exactly the entries for that dept / user / date.
+    on_write() is registered as a database write listener and runs on the DB writer thread.
+    Every write also bumps a generation: callers snapshot it before their read and pass it to
+    put(), which skips the store if a write committed meanwhile (its invalidation ran too early).
+    """
+    def __init__(self, max_bytes: int = REPORT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (value, size, user_ids)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value, size: int, user_ids, generation: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return  # the value may predate a write whose invalidation already ran
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, frozenset(user_ids))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+
+    def on_write(self, keys: list[tuple]) -> None:
+        with self._lock:
+            self._generation += 1
+            for dept, uid, date in keys:
+                if dept is None:
+                    self._entries.clear()
+                    self._bytes = 0
+                    return
+                for key in [k for k, (_, _, uids) in self._entries.items()
+                            if k[1] == dept and k[2] <= date <= k[3] and uid in uids]:
+                    self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self) -> str:
+        with self._lock:
+            return f"entries={len(self._entries)} bytes={self._bytes} hits={self.hits} misses={self.misses}"
+
+report_cache = ReportCache()
+add_write_listener(report_cache.on_write)
+
+def _dept_roles(is_sas: bool) -> list[int]:
+    return [SAS_ROLE_IDS] if is_sas else REQUIRED_PD_ROLE_ID
+
 def _list_pd_members(guild: discord.Guild) -> list[discord.Member]:
-    # Users having any PD role (REQUIRED_PD_ROLE_ID list)
-    out = []
-    for m in guild.members:
-        if not m.bot and has_any(m, REQUIRED_PD_ROLE_ID):
-            out.append(m)
-    return out
+    # Users having any PD role (REQUIRED_PD_ROLE_ID list), sorted by PD callsign
+    return member_index.members(guild, REQUIRED_PD_ROLE_ID, is_sas=False)
 
 def _callsign_sort_key(member: discord.Member, *, is_sas: bool) -> tuple[int, str]:
     """
     Returns a tuple used for sorting members by callsign.
     Members without a detectable callsign are pushed to the end.
     """
-    name = (member.display_name or member.name or "")
-    n = 10**6  # large default -> goes to end
-    m = CALLSIGN_RE.search(name) if is_sas else PD_CALLSIGN_RE.search(name)
-    if not m and not is_sas:
-        # PD fallback: try to catch bare numbers like "001 Name"
-        m = re.search(r"\b(\d{1,3})\b", name)
-    if m:
-        try:
-            n = int(m.group(1))
-        except Exception:
-            pass
-    return (n, name.lower())
+    return callsigns.sort_key(member, is_sas=is_sas)
 
 def _get_week_dates(reference_date: datetime.datetime | None = None) -> tuple[str, list[str]]:
     """
@@ -283,99 +540,369 @@ def _get_week_dates(reference_date: datetime.datetime | None = None) -> tuple[st
     
     return week_label, week_dates
 
-def build_week_report_sas(guild: discord.Guild, week_dates: list[str]) -> list[str]:
+def _week_report_members(guild: discord.Guild, *, is_sas: bool) -> list[discord.Member]:
+    # Sorted by callsign
+    return member_index.members(guild, _dept_roles(is_sas), is_sas=is_sas)
+
+async def build_week_report_file(guild: discord.Guild, dates: list[str], title: str, *, is_sas: bool,
+                                  members: list[discord.Member] | None = None) -> tuple[int, bytes]:
     """
-    Build weekly report for SAS members.
-    Returns lines containing the formatted table.
+    Build the weekly / multi-week report file for PD or SAS members: (member rows, body bytes).
+    The daily totals are read as columns and the table is rendered on the report pool.
     """
-    # Get all SAS members
-    members = []
-    for m in guild.members:
-        if not m.bot and has_role(m, SAS_ROLE_IDS):
-            members.append(m)
-    
-    # Sort by callsign
-    members = sorted(members, key=lambda m: _callsign_sort_key(m, is_sas=True))
-    
-    # Build table header
-    day_names = ["Du", "Lu", "Ma", "Mi", "Jo", "Vi", "Sb"]
-    header = f"{'Nume':<25} " + " ".join(f"{d:>6}" for d in day_names) + "  Total"
-    lines = [header, "-" * len(header)]
-    
-    # Build rows for ALL members
-    for mem in members:
-        # Use display name instead of callsign
-        display_name = (mem.display_name or mem.name or "Unknown")[:25]  # Limit to 25 chars
-        
-        # Calculate minutes for each day
-        day_minutes = []
-        total = 0
-        
-        for date_str in week_dates:
-            sessions = get_clock_times_sas(mem.id, date_str)
-            day_total = 0
-            
-            for s in sessions:
-                if s[0] and s[1]:
-                    ci = parse_local(date_str, s[0])
-                    co = parse_local(date_str, s[1])
-                    mins = (co - ci).total_seconds() / 60
-                    r = round_minutes(mins)
-                    if r > 0:
-                        day_total += r
-            
-            day_minutes.append(day_total)
-            total += day_total
-        
-        # Include ALL members (even with 0 total)
-        day_str = " ".join(f"{int(m):>6}" for m in day_minutes)
-        row = f"{display_name:<25} {day_str}  {int(total):>5}"
-        lines.append(row)
-    
-    if len(lines) == 2:  # Only header + separator (no members with SAS role)
-        lines.append("Niciun membru SAS găsit.")
-    
-    return lines
+    if members is None:
+        members = _week_report_members(guild, is_sas=is_sas)
+    ids = [m.id for m in members]
+    uids, days, minutes = await adb.read(get_minutes_columns, ids, dates[0], dates[-1], dept=_dept(is_sas))
+    names = [m.display_name or m.name or "Unknown" for m in members]
+    return await report_pool.run(
+        render_week_file, title, ids, names, dates, uids, days, minutes, "SAS" if is_sas else "PD"
+    )
 
-def build_day_report(date_str: str, guild: discord.Guild, member: discord.Member | None = None, *, is_sas: bool = False) -> tuple[str, list[str]]:
-    getter = get_clock_times if not is_sas else get_clock_times_sas
+async def build_day_report(date_str: str, guild: discord.Guild, member: discord.Member | None = None, *, is_sas: bool = False) -> tuple[str, list[str]]:
     lines = []
-    members = [member] if member else _list_pd_members(guild)
-
-    if not member:
-        members = sorted(members, key=lambda m: _callsign_sort_key(m, is_sas=is_sas))
-
-    for mem in members:
-        sessions = getter(mem.id, date_str)
+    if member:
+        # Show session detail if single member; duration is the stored rounded minutes
+        by_user = await adb.read(get_sessions_range, [member.id], date_str, date_str, dept=_dept(is_sas))
+        sessions = by_user.get(member.id, {}).get(date_str, [])
+        detail_lines = []
         total = 0
-        for s in sessions:
-            if s[0] and s[1]:
-                ci = parse_local(date_str, s[0])
-                co = parse_local(date_str, s[1])
-                mins = (co - ci).total_seconds() / 60
-                r = round_minutes(mins)
-                if r > 0:
-                    total += r
+        for idx, s in enumerate(sessions, start=1):
+            r = s[2] or 0
+            if s[1] and r > 0:
+                total += r
+                detail_lines.append(f"{idx}. {s[0]} - {s[1]} ({int(r)}min)")
         if total > 0:
-            if member:
-                # Show session detail if single member
-                detail_lines = []
-                for idx, s in enumerate(sessions, start=1):
-                    if s[0] and s[1]:
-                        ci = parse_local(date_str, s[0])
-                        co = parse_local(date_str, s[1])
-                        mins = (co - ci).total_seconds() / 60
-                        r = round_minutes(mins)
-                        if r > 0:
-                            detail_lines.append(f"{idx}. {s[0]} - {s[1]} ({int(r)}min)")
-                lines.append(f"{mem.display_name} Total: ({int(total)})\n" + "\n".join(detail_lines))
-            else:
+            lines.append(f"{member.display_name} Total: ({int(total)})\n" + "\n".join(detail_lines))
+    else:
+        members = member_index.members(guild, REQUIRED_PD_ROLE_ID, is_sas=is_sas)
+        # The member-set version bumps on role changes, joins/leaves and renames
+        key = ("day", _dept(is_sas), date_str, date_str, member_index.version(guild, REQUIRED_PD_ROLE_ID))
+        cached = report_cache.get(key)
+        if cached is not None:
+            return cached
+        generation = report_cache.generation()
+        by_user = await adb.read(get_minutes_range, [m.id for m in members], date_str, date_str, dept=_dept(is_sas))
+        for mem in members:
+            total = by_user.get(mem.id, {}).get(date_str, 0)
+            if total > 0:
                 lines.append(f"{mem.display_name}: ({int(total)} min)")
+        title = f"Raport {date_str} (toți)"
+        if not lines:
+            lines = ["Fără date."]
+        report_cache.put(key, (title, lines), sum(len(l) for l in lines) + len(title), [m.id for m in members], generation)
+        return title, lines
     title = f"Raport {date_str}" + (f" - {member.display_name}" if member else " (toți)")
     if not lines:
         lines = ["Fără date."]
     return title, lines
 
+DAY_REPORT_PAGE_LINES = 40
+
+async def build_day_report_page(date_str: str, guild: discord.Guild, *, is_sas: bool = False,
+                                after: tuple | None = None) -> tuple[list[str], tuple | None]:
+    """
+    One page of the "all" day report: the next DAY_REPORT_PAGE_LINES members with minutes,
+    in callsign order, strictly after the keyset cursor `after` (a MemberIndex.sort_key).
+    Totals are read from daily_totals one page-sized chunk of members at a time.
+    Returns (lines, cursor of the next page or None on the last page).
+    """
+    members = member_index.members(guild, REQUIRED_PD_ROLE_ID, is_sas=is_sas)
+    keys = [member_index.sort_key(guild, m.id, is_sas=is_sas) for m in members]
+    pos = bisect.bisect_right(keys, after) if after is not None else 0
+    found: list[tuple[tuple, str]] = []
+    # One row past the page tells whether there is a next page
+    while pos < len(members) and len(found) <= DAY_REPORT_PAGE_LINES:
+        chunk = members[pos:pos + DAY_REPORT_PAGE_LINES + 1 - len(found)]
+        by_user = await adb.read(get_minutes_range, [m.id for m in chunk], date_str, date_str, dept=_dept(is_sas))
+        for mem in chunk:
+            pos += 1
+            total = by_user.get(mem.id, {}).get(date_str, 0)
+            if total > 0:
+                found.append((keys[pos - 1], f"{mem.display_name}: ({int(total)} min)"))
+                if len(found) > DAY_REPORT_PAGE_LINES:
+                    break
+    next_cursor = None
+    if len(found) > DAY_REPORT_PAGE_LINES:
+        found.pop()
+        next_cursor = found[-1][0]
+    return [line for _, line in found], next_cursor
+
+LEADERBOARD_SIZE = 10
+
+def _leaderboard_range(period: str) -> tuple[str, str, str]:
+    """(date_from, date_to, label) for 'week' (Sunday-Saturday, like the weekly report) or 'month'."""
+    if period == "week":
+        label, dates = _get_week_dates()
+        return dates[0], dates[-1], f"Săptămâna {label}"
+    today = local_now().date()
+    last = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+    return today.replace(day=1).isoformat(), last.isoformat(), f"Luna {today.strftime('%m.%Y')}"
+
+async def build_leaderboard(guild: discord.Guild, period: str, *, is_sas: bool) -> tuple[str, str]:
+    """(title, description) of the top LEADERBOARD_SIZE members by minutes; ranking is done in SQL."""
+    date_from, date_to, label = _leaderboard_range(period)
+    rows = await adb.read(get_leaderboard, date_from, date_to, dept=_dept(is_sas), limit=LEADERBOARD_SIZE)
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = []
+    for rank, uid, total in rows:
+        member = guild.get_member(uid) if guild else None
+        name = member.display_name if member else f"<@{uid}>"
+        h, m = divmod(int(total), 60)
+        lines.append(f"{medals.get(rank, f'`{rank:>2}.`')} {name} - **{h}h {m:02d}m**")
+    title = f"🏆 Top {LEADERBOARD_SIZE} {'SAS' if is_sas else 'PD'} - {label}"
+    return title, "\n".join(lines) or "Fără date."
+
+
+# --------------- Helpers (export) ---------------
+EXPORT_SPOOL_BYTES = 4 * 1024 * 1024  # exports bigger than this spill from memory to a temp file
+EXPORT_HEADER = ["Departament", "User ID", "Nume", "Data", "Start", "Stop", "Minute"]
+
+def _export_rows(date_from: str, date_to: str, dept: str | None, names: dict[int, str]):
+    """
+    Session rows straight from the DB cursor, plus a TOTAL row after each member
+    (rows arrive ordered by member, so only the running sum is kept).
+    """
+    current = None
+    total = 0
+    for dept_, uid, date, ci, co, duration in iter_sessions_range(date_from, date_to, dept):
+        if current is not None and current != (dept_, uid):
+            yield [current[0], current[1], names.get(current[1], ""), "TOTAL", "", "", total]
+            total = 0
+        current = (dept_, uid)
+        minutes = duration if co and duration and duration > 0 else 0
+        total += minutes
+        yield [dept_, uid, names.get(uid, ""), date, ci, co or "", minutes]
+    if current is not None:
+        yield [current[0], current[1], names.get(current[1], ""), "TOTAL", "", "", total]
+
+def _write_month_export(fmt: str, date_from: str, date_to: str, dept: str | None, names: dict[int, str]):
+    """
+    Runs on a DB reader thread (adb.read): streams the month into a spooled temp file.
+    Returns (fileobj, rows). XLSX needs openpyxl (optional dependency, imported lazily).
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    rows = 0
+    if fmt == "xlsx":
+        from openpyxl import Workbook  # optional; ImportError is reported to the user
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Pontaje")
+        ws.append(EXPORT_HEADER)
+        for row in _export_rows(date_from, date_to, dept, names):
+            ws.append(row)
+            rows += 1
+        wb.save(out)
+    else:
+        text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+        writer = csv.writer(text)
+        writer.writerow(EXPORT_HEADER)
+        for row in _export_rows(date_from, date_to, dept, names):
+            writer.writerow(row)
+            rows += 1
+        text.flush()
+        text.detach()
+    out.seek(0)
+    return out, rows
+
+def _compress_export(src, filename: str):
+    """
+    gzip a CSV into a new spooled file. Returns (fileobj, filename).
+    XLSX is not handled: it is already a deflated zip and would barely shrink.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    with gzip.GzipFile(filename=filename, mode="wb", fileobj=out) as gz:
+        shutil.copyfileobj(src, gz)
+    filename += ".gz"
+    src.close()
+    out.seek(0)
+    return out, filename
+
+def _file_size(f) -> int:
+    f.seek(0, io.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    return size
+
+# --------------- Helpers (staffing) ---------------
+def _format_staffing(stats, min_headcount: int) -> str:
+    lines = [f"Sesiuni: **{stats.sessions}**"]
+    if stats.peak_at is not None:
+        at = datetime.datetime.fromtimestamp(stats.peak_at, LOCAL_TZ)
+        lines.append(f"Vârf: **{stats.peak}** simultan ({at.strftime('%d.%m %H:%M')})")
+    else:
+        lines.append("Vârf: **0**")
+    if min_headcount > 0:
+        h, m = divmod(stats.below_min_seconds // 60, 60)
+        lines.append(f"Sub minim ({min_headcount}): **{h}h {m}m**")
+    if len(stats.daily_peaks) > 1:
+        lines.append("")
+        lines.append("Vârf pe zi: " + ", ".join(
+            f"{datetime.date.fromisoformat(d).strftime('%d.%m')}: {p}" for d, p in sorted(stats.daily_peaks.items())
+        ))
+    top = max(stats.hourly_avg) or 1
+    hist = [f"{h:02d} {'█' * round(avg / top * 20):<20} {avg:.1f}" for h, avg in enumerate(stats.hourly_avg)]
+    lines.append("")
+    lines.append("Medie pe oră:")
+    lines.append("```\n" + "\n".join(hist) + "\n```")
+    return "\n".join(lines)
+
+
+# --------------- Live dashboard ---------------
+DASHBOARD_EDIT_INTERVAL = 5  # seconds; dashboard edits are coalesced to at most one per interval
+
+class OnDutyState:
+    """
+    Open sessions per department, in memory: dept -> {user_id: [(date, clock_in), ...]}.
+    Loaded once, then refreshed per touched (dept, user) from a DB write listener, so the
+    "Pontaje Deschise" buttons and the dashboards never scan the sessions table.
+    Both load() and on_write() re-read under the lock, so they converge in any order.
+    """
+    def __init__(self):
+        self._open: dict[str, dict[int, list[tuple[str, str]]]] = {DEPT_PD: {}, DEPT_SAS: {}}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.on_change = None  # called with the set of changed depts, from any thread
+
+    def load(self) -> None:
+        # Runs on a DB thread (adb.read)
+        with self._lock:
+            self._load_locked()
+        self._notify({DEPT_PD, DEPT_SAS})
+
+    def _load_locked(self) -> None:
+        fresh: dict[str, dict[int, list[tuple[str, str]]]] = {DEPT_PD: {}, DEPT_SAS: {}}
+        for dept, uid, date, ci in get_ongoing_sessions_all():
+            fresh.setdefault(dept, {}).setdefault(uid, []).append((date, ci))
+        self._open = fresh
+        self.loaded = True
+
+    def on_write(self, keys: list[tuple]) -> None:
+        changed = set()
+        with self._lock:
+            if not self.loaded:
+                return
+            for dept, uid, date in keys:
+                if dept is None:
+                    self._load_locked()
+                    changed = {DEPT_PD, DEPT_SAS}
+                    break
+                rows = [(d, ci) for _, d, ci in get_ongoing_sessions(uid, dept=dept)]
+                by_user = self._open.setdefault(dept, {})
+                if by_user.get(uid, []) != rows:
+                    if rows:
+                        by_user[uid] = rows
+                    else:
+                        by_user.pop(uid, None)
+                    changed.add(dept)
+        if changed:
+            self._notify(changed)
+
+    def _notify(self, depts: set[str]) -> None:
+        if self.on_change is not None:
+            self.on_change(depts)
+
+    def sessions(self, dept: str, date: str | None = None) -> list[tuple[int, str, str]]:
+        """[(user_id, date, clock_in)] ordered by date, clock_in."""
+        with self._lock:
+            out = [(uid, d, ci) for uid, rows in self._open.get(dept, {}).items() for d, ci in rows
+                   if date is None or d == date]
+        out.sort(key=lambda r: (r[1], r[2]))
+        return out
+
+on_duty = OnDutyState()
+add_write_listener(on_duty.on_write)
+
+async def _open_sessions(dept: str, date: str | None = None) -> list[tuple[int, str, str]]:
+    if not on_duty.loaded:
+        await adb.read(on_duty.load)
+    return on_duty.sessions(dept, date)
+
+class LiveDashboards:
+    """
+    One pinned message per department listing who is on duty and since when.
+    OnDutyState marks departments dirty; a single task edits the dirty messages and then
+    waits DASHBOARD_EDIT_INTERVAL, so bursts of clock-ins become one edit.
+    """
+    def __init__(self, state: OnDutyState):
+        self.state = state
+        self.targets: dict[str, tuple[int, int]] = {}  # dept -> (channel_id, message_id)
+        self._dirty: set[str] = set()
+        self._event: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self.targets = await adb.read(get_dashboards)
+        self.state.on_change = self.mark
+        await adb.read(self.state.load)
+        self._task = asyncio.create_task(self._run())
+
+    def mark(self, depts: set[str]) -> None:
+        # Called from DB threads
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._mark, set(depts))
+
+    def _mark(self, depts: set[str]) -> None:
+        self._dirty |= depts
+        self._event.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            dirty, self._dirty = self._dirty, set()
+            for dept in dirty:
+                try:
+                    await self.refresh(dept)
+                except Exception:
+                    logging.exception("Dashboard update failed for %s", dept)
+            await asyncio.sleep(DASHBOARD_EDIT_INTERVAL)
+
+    def render(self, dept: str, guild: discord.Guild | None) -> discord.Embed:
+        today = local_now().strftime("%Y-%m-%d")
+        lines = []
+        for uid, date, ci in self.state.sessions(dept):
+            member = guild.get_member(uid) if guild else None
+            name = member.display_name if member else f"<@{uid}>"
+            since = ci[:5] if date == today else f"{date[8:10]}.{date[5:7]} {ci[:5]}"
+            lines.append(f"{name} - din {since}")
+        label = "SAS" if dept == DEPT_SAS else "PD"
+        return make_embed(
+            f"🟢 În tură {label} - {len(lines)}",
+            "\n".join(lines)[:3900] or "Nimeni în tură.",
+            discord.Color.green() if lines else discord.Color.dark_grey()
+        )
+
+    async def refresh(self, dept: str) -> None:
+        target = self.targets.get(dept)
+        if target is None:
+            return
+        channel = bot.get_channel(target[0])
+        if not isinstance(channel, discord.TextChannel):
+            return
+        try:
+            await channel.get_partial_message(target[1]).edit(embed=self.render(dept, channel.guild))
+        except discord.NotFound:
+            # Message deleted by hand: stop updating it
+            self.targets.pop(dept, None)
+            await adb.write(remove_dashboard, dept)
+
+    async def create(self, dept: str, channel: discord.TextChannel) -> discord.Message:
+        msg = await channel.send(embed=self.render(dept, channel.guild))
+        try:
+            await msg.pin()
+        except discord.HTTPException:
+            pass
+        await adb.write(set_dashboard, dept, channel.id, msg.id)
+        self.targets[dept] = (channel.id, msg.id)
+        return msg
+
+dashboards = LiveDashboards(on_duty)
+
 
 # --------------- Helpers (warn) ---------------
 
@@ -406,6 +933,20 @@ def _send_warn_to_channel(guild: discord.Guild, embed: discord.Embed, *, mention
     except Exception:
         pass
 
+def _format_warn_history(history: list[tuple]) -> str:
+    """history rows: (kind, actor_id, reason, ts), newest first."""
+    if not history:
+        return "Fără istoric."
+    lines = []
+    for kind, actor_id, reason, ts in history:
+        label = "Warn" if kind == "warn" else "Reset"
+        actor = f"<@{actor_id}>" if actor_id else "?"
+        line = f"<t:{ts}:d> {label} de {actor}"
+        if reason:
+            line += f": {reason[:120]}"
+        lines.append(line)
+    return "Istoric:\n" + "\n".join(lines)
+
 def _build_warn_embed(actor: discord.Member, target: discord.Member, title: str, body: str, color: discord.Color):
     return make_embed(title, f"{target.mention}\n{body}", color, actor)
 
@@ -456,42 +997,440 @@ async def _post_warn(
 
 # --------------- SAS EVIDENTA MEMBRII ---------------
 
-def get_google_sheets_client():
-    """Initialize and return Google Sheets client."""
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_SHEETS_CREDENTIALS_FILE, scope)
-    return gspread.authorize(creds)
+SHEETS_SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+SHEETS_REFRESH_CHECK_SECS = 300          # how often the background task looks at the token
+SHEETS_REFRESH_MARGIN = datetime.timedelta(minutes=10)  # re-authorize this long before expiry
 
-def _extract_pd_callsign(member: discord.Member | None) -> str | None:
-    """Extract PD callsign [xxx] from member display name."""
-    if not member:
-        return None
-    name = (member.display_name or member.name)
-    m = PD_CALLSIGN_RE.search(name)
-    if not m:
+class SheetsService:
+    """
+    One authorized gspread client (and its HTTP session) for the whole bot.
+    The credentials file is read once; a background task re-authorizes shortly before the
+    OAuth token expires, so calls never pay for it. Blocking gspread calls go through run(),
+    which executes them on a single dedicated "sheets" thread: never on the event loop, and
+    one at a time, so roster read-modify-write sequences cannot interleave.
+    """
+    def __init__(self):
+        self._client: gspread.Client | None = None
+        self._sheets: dict[str, Any] = {}  # spreadsheet id -> first worksheet
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets")
+        self._refresh_task: asyncio.Task | None = None
+
+    def client(self) -> gspread.Client:
+        with self._lock:
+            if self._client is None:
+                creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_SHEETS_CREDENTIALS_FILE, SHEETS_SCOPE)
+                self._client = gspread.authorize(creds)
+                self._sheets.clear()
+            return self._client
+
+    def sheet(self, spreadsheet_id: str):
+        """First worksheet of a spreadsheet; opened once (open_by_key is a request of its own)."""
+        ws = self._sheets.get(spreadsheet_id)
+        if ws is None:
+            ws = self._sheets[spreadsheet_id] = self.client().open_by_key(spreadsheet_id).sheet1
+        return ws
+
+    def _token_expiring(self) -> bool:
+        auth = getattr(self._client, "auth", None)
+        if auth is None:
+            return False
+        if getattr(auth, "access_token_expired", False):
+            return True
+        expiry = getattr(auth, "token_expiry", None) or getattr(auth, "expiry", None)  # oauth2client / google-auth
+        return expiry is not None and expiry - datetime.datetime.utcnow() < SHEETS_REFRESH_MARGIN
+
+    def refresh_if_needed(self) -> None:
+        if self._client is None or not self._token_expiring():
+            return
+        with self._lock:
+            self._client = None
+        self.client()
+        logging.info("Google Sheets client re-authorized")
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def start(self) -> None:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SHEETS_REFRESH_CHECK_SECS)
+            try:
+                await self.run(self.refresh_if_needed)
+            except Exception:
+                logging.exception("Google Sheets token refresh failed")
+
+sheets = SheetsService()
+
+SHEETS_BACKOFF_BASE = 2     # seconds; doubled per failed attempt
+SHEETS_BACKOFF_MAX = 300
+SHEETS_PENDING = "în curs de sincronizare"  # shown instead of values the outbox has not written yet
+
+def _sheets_retry_after(e: Exception) -> float | None:
+    """
+    Seconds to wait before retrying a failed Sheets call (Retry-After, else 0),
+    or None when retrying cannot help. Quota (429), server (5xx) and network errors are transient.
+    """
+    resp = getattr(e, "response", None)
+    status = getattr(resp, "status_code", None)
+    if status is None:
+        return 0.0 if isinstance(e, OSError) else None  # requests' ConnectionError / Timeout
+    if status != 429 and status < 500:
         return None
-    digits = m.group(1)
     try:
-        num = int(digits)
-    except ValueError:
-        logging.warning("Invalid PD callsign digits '%s' in name '%s'", digits, name)
+        return float(resp.headers.get("Retry-After") or 0)
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+def _sheets_rejected(e: Exception) -> bool:
+    """A 4xx that is about the request itself (bad range / value), so resending it cannot succeed."""
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return status is not None and 400 <= status < 500 and status not in (401, 403, 408, 429)
+
+def _a1_row(a1_range: str) -> int | None:
+    m = re.search(r"![A-Z]+(\d+)", a1_range)
+    return int(m.group(1)) if m else None
+
+class SheetsOutbox:
+    """
+    Write-behind queue for Sheets mutations, persisted in the sheets_outbox table so nothing is
+    lost on restart. put() records (range, values) writes - a newer write to a queued range
+    replaces it - and wakes the worker, which sends everything due for a spreadsheet in one
+    values:batchUpdate on the sheets thread. A failed batch stays queued and its spreadsheet
+    backs off exponentially (at least Retry-After), so a quota burst is not made worse.
+    A write the API rejects outright (4xx) is dead-lettered (kept, logged, counted in !dbs)
+    so it cannot hold up the rest. Table writes go through the DB writer thread.
+    """
+    def __init__(self):
+        self._retry_at: dict[str, float] = {}  # spreadsheet id -> epoch of the next attempt
+        self._listeners: dict[str, Any] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def on_applied(self, spreadsheet_id: str, fn) -> None:
+        """fn(updated_data) runs on the sheets thread after a batch lands (the API's updatedData per range)."""
+        self._listeners[spreadsheet_id] = fn
+
+    def put(self, spreadsheet_id: str, data: list[tuple[str, list[list]]]) -> None:
+        adb.write_blocking(outbox_put, spreadsheet_id, [(rng, json.dumps(values)) for rng, values in data])
+        self.wake()
+
+    def pending(self, spreadsheet_id: str) -> dict[str, list[list]]:
+        return {rng: json.loads(values) for rng, values in outbox_pending(spreadsheet_id)}
+
+    def back_off(self, spreadsheet_id: str, seconds: float) -> None:
+        """Hold the spreadsheet's next attempt (e.g. Retry-After of a direct call that failed)."""
+        self._retry_at[spreadsheet_id] = max(self._retry_at.get(spreadsheet_id, 0), time.time() + seconds)
+
+    def wake(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._worker())
+
+    async def _worker(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                delay = await sheets.run(self.flush)
+            except Exception:
+                logging.exception("Sheets outbox flush failed")
+                delay = SHEETS_BACKOFF_MAX
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def flush(self) -> float | None:
+        """Send the due writes, one batch per spreadsheet; returns seconds until the next attempt (None: queue empty)."""
+        now = time.time()
+        batches: dict[str, list] = {}
+        for row in outbox_due(int(now)):
+            if self._retry_at.get(row[1], 0) <= now:
+                batches.setdefault(row[1], []).append(row)
+
+        for spreadsheet_id, rows in batches.items():
+            self._send(spreadsheet_id, rows, now)
+
+        waits = [max(ts, self._retry_at.get(sid, 0)) - time.time() for sid, ts in outbox_next_due().items()]
+        return max(0.0, min(waits)) if waits else None
+
+    def _send(self, spreadsheet_id: str, rows: list, now: float) -> bool:
+        """One values:batchUpdate for `rows` (outbox_due tuples); False if the spreadsheet is now backing off."""
+        body = {
+            "valueInputOption": "USER_ENTERED",
+            "includeValuesInResponse": True,
+            "data": [{"range": rng, "values": json.loads(values)} for _, _, rng, values, _, _ in rows],
+        }
+        try:
+            resp = sheets.sheet(spreadsheet_id).spreadsheet.values_batch_update(body)
+        except Exception as e:
+            if _sheets_rejected(e):
+                if len(rows) > 1:
+                    # A batch is all-or-nothing: send its writes one by one to find the rejected ones
+                    return all(self._send(spreadsheet_id, [row], now) for row in rows)
+                adb.write_blocking(outbox_fail, [(rows[0][0], rows[0][4])], str(e)[:500])
+                logging.error(f"Sheets outbox: write {rows[0][2]} = {rows[0][3]} rejected, dead-lettered: {e}")
+                return True
+            retry_after = _sheets_retry_after(e)
+            attempts = max(r[5] for r in rows)
+            delay = min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempts) * random.uniform(0.5, 1.0)
+            if retry_after is None:
+                delay = SHEETS_BACKOFF_MAX  # unknown failure (e.g. auth): keep the writes and retry rarely
+                logging.error(f"Sheets outbox: {len(rows)} writes to {spreadsheet_id} failed: {e}")
+            else:
+                delay = max(delay, retry_after)
+                logging.warning(f"Sheets outbox: {len(rows)} writes to {spreadsheet_id} deferred {delay:.0f}s: {e}")
+            self._retry_at[spreadsheet_id] = now + delay
+            adb.write_blocking(outbox_retry, [r[0] for r in rows], int(now + delay), str(e)[:500])
+            return False
+
+        self._retry_at.pop(spreadsheet_id, None)
+        adb.write_blocking(outbox_done, [(r[0], r[4]) for r in rows])
+        listener = self._listeners.get(spreadsheet_id)
+        if listener is not None:
+            try:
+                listener([r.get("updatedData", {}) for r in resp.get("responses", [])])
+            except Exception:
+                logging.exception("Sheets outbox listener failed")
+        return True
+
+sheets_outbox = SheetsOutbox()
+
+SAS_ROSTER_RANGE = "B7:D46"   # B = PD ID, D = SAS callsign (computed by the sheet)
+SAS_ROSTER_FIRST_ROW = 7
+SAS_ROSTER_LAST_ROW = 46
+SAS_ROSTER_TTL = 60           # seconds; lookups only, mutations always reload
+# Rank ladder, top -> bottom: (key, label, rows in column B)
+SAS_RANK_LADDER = [
+    ('coordonator_sas', 'Coordonator SAS', range(11, 13)),            # B11:B12
+    ('coordonator_teste', 'Coordonator SAS - TESTE', range(14, 17)),  # B14:B16
+    ('agent_special', 'AGENT SPECIAL', range(18, 22)),                # B18:B21
+    ('agent_sas', 'AGENT S.A.S', range(23, 41)),                      # B23:B40
+]
+SAS_RANK_ROWS = {key: rows for key, _, rows in SAS_RANK_LADDER}
+SAS_RANK_LABELS = {key: label for key, label, _ in SAS_RANK_LADDER}
+SAS_RANK_ORDER = [key for key, _, _ in SAS_RANK_LADDER]
+SAS_RANK_HINTS = {'agent_special': 'ALPHA/OMEGA/DELTA/TITAN'}
+
+def _sas_rank_span(rank: str) -> str:
+    rows = SAS_RANK_ROWS[rank]
+    return f"B{rows[0]}:B{rows[-1]}"
+
+class SASRoster:
+    """
+    Local mirror of the SAS roster (B7:D46), loaded with a single batch_get and indexed by
+    PD ID and by rank range, so lookups and free-slot searches don't touch the network.
+    Lookups reload it when older than SAS_ROSTER_TTL; mutations reload it first (one batch_get),
+    so a slot filled by hand in the sheet is never overwritten. Writes still queued in the
+    outbox are laid over the sheet's values. Used on the sheets thread only.
+    """
+    def __init__(self):
+        self._ids: dict[int, str] = {}        # row -> B value
+        self._callsigns: dict[int, str] = {}  # row -> D value
+        self._row_of: dict[str, int] = {}     # B value -> first row holding it
+        self._loaded_at = 0.0
+
+    def refresh(self) -> None:
+        values = sheets.sheet(SAS_SPREADSHEET_ID).batch_get([SAS_ROSTER_RANGE])[0]
+        ids, callsigns = {}, {}
+        for row in range(SAS_ROSTER_FIRST_ROW, SAS_ROSTER_LAST_ROW + 1):
+            vals = values[row - SAS_ROSTER_FIRST_ROW] if row - SAS_ROSTER_FIRST_ROW < len(values) else []
+            ids[row] = (vals[0] if vals else "").strip()
+            callsigns[row] = vals[2] if len(vals) > 2 else ""
+        for rng, vals in sheets_outbox.pending(SAS_SPREADSHEET_ID).items():
+            row = _a1_row(rng)
+            if row in ids:
+                ids[row] = str(vals[0][0] or "").strip()
+                callsigns[row] = ""
+        self._ids, self._callsigns = ids, callsigns
+        self._reindex()
+        self._loaded_at = time.monotonic()
+
+    def _reindex(self) -> None:
+        self._row_of = {}
+        for row in sorted(self._ids):
+            if self._ids[row]:
+                self._row_of.setdefault(self._ids[row], row)
+
+    def ensure(self) -> None:
+        if time.monotonic() - self._loaded_at > SAS_ROSTER_TTL:
+            self.refresh()
+
+    def row_of(self, discord_id: str) -> int | None:
+        return self._row_of.get(discord_id)
+
+    def rank_of(self, discord_id: str) -> str | None:
+        row = self._row_of.get(discord_id)
+        for name, rows in SAS_RANK_ROWS.items():
+            if row in rows:
+                return name
         return None
-    if num < 1 or num > 999:
+
+    def free_row(self, rank: str) -> int | None:
+        return next((r for r in SAS_RANK_ROWS[rank] if not self._ids.get(r)), None)
+
+    def invalidate(self) -> None:
+        # After a failed write the sheet state is unknown: reload on next use
+        self._loaded_at = 0.0
+
+    def apply(self, updated: list[dict]) -> None:
+        """
+        Take the rows from a batchUpdate response (updatedData per B:D range) into the mirror.
+        The API leaves out trailing empty cells (a cleared row has no values at all), so missing
+        cells are empty; only a range that cannot be parsed needs a read-back.
+        """
+        complete = True
+        for data in updated:
+            row = _a1_row(data.get("range", ""))
+            if row is None:
+                complete = False
+                continue
+            vals = (data.get("values") or [[]])[0]
+            self._ids[row] = (vals[0] if vals else "").strip()
+            self._callsigns[row] = vals[2] if len(vals) > 2 else ""
+        if complete:
+            self._reindex()
+        else:
+            self.refresh()
+
+    def write(self, updates: dict[int, str]) -> dict[int, str]:
+        """
+        Set column B on the given rows and return {row: callsign}.
+        Normally one values:batchUpdate: each row is written as B:D with C/D null (skipped by the API),
+        and the response carries the rows' values after recalculation, so the new callsigns come back
+        in the same request. If Google throttles or fails (or older writes are still queued) the rows
+        go to the outbox instead: the mirror takes them at once and the callsigns read SHEETS_PENDING.
+        """
+        ws = sheets.sheet(SAS_SPREADSHEET_ID)
+        data = [(f"'{ws.title}'!B{row}:D{row}", [[value, None, None]]) for row, value in updates.items()]
+        if not sheets_outbox.pending(SAS_SPREADSHEET_ID):
+            body = {
+                "valueInputOption": "USER_ENTERED",
+                "includeValuesInResponse": True,
+                "data": [{"range": rng, "values": values} for rng, values in data],
+            }
+            try:
+                resp = ws.spreadsheet.values_batch_update(body)
+            except Exception as e:
+                retry_after = _sheets_retry_after(e)
+                if retry_after is None:
+                    raise
+                sheets_outbox.back_off(SAS_SPREADSHEET_ID, retry_after)
+                logging.warning(f"SAS roster write queued in the outbox: {e}")
+            else:
+                self.apply([r.get("updatedData", {}) for r in resp.get("responses", [])])
+                return {row: self._callsigns.get(row) or "N/A" for row in updates}
+
+        sheets_outbox.put(SAS_SPREADSHEET_ID, data)
+        for row, value in updates.items():
+            self._ids[row] = value.strip()
+            self._callsigns[row] = ""
+        self._reindex()
+        return {row: SHEETS_PENDING for row in updates}
+
+    def move(self, discord_id: str, target: str) -> tuple[bool, str]:
+        """Move discord_id to the first free slot of rank `target`, in one request."""
+        src = self.row_of(discord_id)
+        if src is None:
+            return False, "Membrul nu a fost găsit în niciun interval"
+        dst = self.free_row(target)
+        if dst is None:
+            return False, f"Nu există poziții libere în {SAS_RANK_LABELS[target]} ({_sas_rank_span(target)})"
+        callsign = self.write({src: "", dst: discord_id})[dst]
+        return True, f"Membru mutat la {SAS_RANK_LABELS[target]}: {callsign}"
+
+sas_roster = SASRoster()
+sheets_outbox.on_applied(SAS_SPREADSHEET_ID, sas_roster.apply)
+
+def _extract_pd_callsign(member: discord.Member | None) -> str | None:
+    """Extract PD callsign [xxx] from member display name."""
+    if not member:
         return None
-    return digits  # Return as-is (e.g., "203", "005")
+    return callsigns.pd(member)
+
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+PD_INDEX_CHECK_SECS = 60      # after this, ask Drive whether the spreadsheet changed
+PD_INDEX_MAX_AGE_SECS = 900   # reload regardless after this
+PD_INDEX_MISS_CHECK_SECS = 10  # a miss re-checks the revision at most this often
+
+class PDCallsignIndex:
+    """
+    Cell value -> PD ID (column A of the same row) for the whole PD spreadsheet, built from one
+    get_all_values() request. Keeps sheet.find()'s semantics: exact match, first hit in row-major
+    order. Refreshed by revision: once the index is PD_INDEX_CHECK_SECS old the spreadsheet's
+    modifiedTime is fetched (a cheap Drive metadata call) and the values are re-read only
+    if it changed, or after PD_INDEX_MAX_AGE_SECS. Used on the sheets thread only.
+    """
+    def __init__(self):
+        self._ids: dict[str, str] = {}
+        self._revision: str | None = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def _current_revision(self) -> str | None:
+        """
+        Drive modifiedTime of the PD spreadsheet, asked for on every call: Spreadsheet.lastUpdateTime
+        is only read when the (cached) spreadsheet object is created. None forces a reload.
+        """
+        try:
+            spreadsheet = sheets.sheet(PD_SPREADSHEET_ID).spreadsheet
+            if hasattr(spreadsheet, "get_lastUpdateTime"):
+                return spreadsheet.get_lastUpdateTime()
+            resp = sheets.client().request(
+                "get", f"{DRIVE_FILES_URL}/{PD_SPREADSHEET_ID}",
+                params={"fields": "modifiedTime", "supportsAllDrives": True},
+            )
+            return resp.json()["modifiedTime"]
+        except Exception:
+            return None
+
+    def reload(self) -> None:
+        revision = self._current_revision()
+        ids: dict[str, str] = {}
+        for row in sheets.sheet(PD_SPREADSHEET_ID).get_all_values():
+            pd_id = row[0] if row else ""
+            for value in row:
+                if value:
+                    ids.setdefault(value, pd_id)
+        self._ids, self._revision = ids, revision
+        self._loaded_at = self._checked_at = time.monotonic()
+        logging.info("PD callsign index loaded: %d values", len(ids))
+
+    def _refresh(self, check_after: float) -> None:
+        now = time.monotonic()
+        if not self._loaded_at or now - self._loaded_at > PD_INDEX_MAX_AGE_SECS:
+            self.reload()
+        elif now - self._checked_at > check_after:
+            revision = self._current_revision()
+            if revision is None or revision != self._revision:
+                self.reload()
+            else:
+                self._checked_at = now
+
+    def lookup(self, callsign: str) -> str | None:
+        self._refresh(PD_INDEX_CHECK_SECS)
+        pd_id = self._ids.get(callsign)
+        if pd_id is None:
+            # Maybe added since the last check (new member): look again if the sheet changed
+            self._refresh(PD_INDEX_MISS_CHECK_SECS)
+            pd_id = self._ids.get(callsign)
+        return pd_id or None
+
+pd_index = PDCallsignIndex()
 
 def get_pd_id_by_callsign(callsign: str) -> str | None:
     """Find PD ID (column A) by callsign in PD spreadsheet."""
     try:
-        client = get_google_sheets_client()
-        sheet = client.open_by_key(PD_SPREADSHEET_ID).sheet1
-        
-        # Search for callsign in the sheet
-        cell = sheet.find(callsign)
-        if cell:
-            # Get ID from column A of the same row
-            return sheet.cell(cell.row, 1).value
-        return None
+        return pd_index.lookup(callsign)
     except Exception as e:
         logging.error(f"Error getting PD ID for callsign {callsign}: {e}")
         return None
@@ -502,214 +1441,62 @@ def add_member_to_sas_excel(discord_id: str) -> tuple[bool, str]:
     Returns (success, message with callsign from column D).
     """
     try:
-        client = get_google_sheets_client()
-        sheet = client.open_by_key(SAS_SPREADSHEET_ID).sheet1
-        
-        # Get range B23:B40
-        cells = sheet.range('B23:B40')
-        
-        # Find first empty cell
-        for cell in cells:
-            if not cell.value or cell.value.strip() == "":
-                # Write as formula to trigger auto-complete in other columns
-                cell.value = discord_id
-                sheet.update_cells([cell])
-                
-                # Force recalculation
-                batch_data = [{
-                    'range': cell.address,
-                    'values': [[discord_id]]
-                }]
-                sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                
-                # Get callsign from column D (same row)
-                row = cell.row
-                callsign_cell = sheet.cell(row, 4)  # Column D is index 4
-                callsign = callsign_cell.value or "N/A"
-                
-                return True, f"Membru adăugat: {callsign}"
-        
-        return False, "Nu există poziții libere în intervalul B23:B40"
+        sas_roster.refresh()
+        row = sas_roster.free_row('agent_sas')
+        if row is None:
+            return False, "Nu există poziții libere în intervalul B23:B40"
+        callsign = sas_roster.write({row: discord_id})[row]
+        return True, f"Membru adăugat: {callsign}"
     except Exception as e:
+        sas_roster.invalidate()
         logging.error(f"Error adding member to SAS excel: {e}")
         return False, f"Eroare: {str(e)}"
 
 def move_member_in_sas_excel(discord_id: str, direction: str) -> tuple[bool, str]:
+    """Move member one rank up or down the ladder."""
     try:
-        client = get_google_sheets_client()
-        sheet = client.open_by_key(SAS_SPREADSHEET_ID).sheet1
-        
-        ranges = {
-            'coordonator_sas': sheet.range('B11:B12'),
-            'coordonator_teste': sheet.range('B14:B16'),
-            'agent_special': sheet.range('B18:B21'),
-            'agent_sas': sheet.range('B23:B40')
-        }
-        
-        member_range = None
-        member_cell = None
-        
-        for range_name, cells in ranges.items():
-            for cell in cells:
-                if cell.value == discord_id:
-                    member_range = range_name
-                    member_cell = cell
-                    break
-            if member_range:
-                break
-        
-        if not member_range:
+        sas_roster.refresh()
+        rank = sas_roster.rank_of(discord_id)
+        if rank is None:
             return False, "Membrul nu a fost găsit în niciun interval"
-        
+        idx = SAS_RANK_ORDER.index(rank)
         if direction == 'up':
-            if member_range == 'coordonator_sas':
-                return False, "Membrul este deja la Coordonator SAS (cel mai înalt rang)"
-            
-            elif member_range == 'coordonator_teste':
-                target_cells = ranges['coordonator_sas']
-                for target_cell in target_cells:
-                    if not target_cell.value or target_cell.value.strip() == "":
-                        # Move and trigger recalculation
-                        member_cell.value = ""
-                        target_cell.value = discord_id
-                        sheet.update_cells([member_cell, target_cell])
-                        
-                        # Force recalc
-                        batch_data = [
-                            {'range': member_cell.address, 'values': [[""]]},
-                            {'range': target_cell.address, 'values': [[discord_id]]}
-                        ]
-                        sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                        
-                        # Get callsign from column D
-                        callsign = sheet.cell(target_cell.row, 4).value or "N/A"
-                        return True, f"Membru mutat la Coordonator SAS: {callsign}"
-                return False, "Nu există poziții libere în Coordonator SAS (B11:B12)"
-            
-            elif member_range == 'agent_special':
-                target_cells = ranges['coordonator_teste']
-                for target_cell in target_cells:
-                    if not target_cell.value or target_cell.value.strip() == "":
-                        member_cell.value = ""
-                        target_cell.value = discord_id
-                        sheet.update_cells([member_cell, target_cell])
-                        batch_data = [
-                            {'range': member_cell.address, 'values': [[""]]},
-                            {'range': target_cell.address, 'values': [[discord_id]]}
-                        ]
-                        sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                        
-                        # Get callsign from column D
-                        callsign = sheet.cell(target_cell.row, 4).value or "N/A"
-                        return True, f"Membru mutat la Coordonator SAS - TESTE: {callsign}"
-                return False, "Nu există poziții libere în Coordonator SAS - TESTE (B14:B16)"
-            
-            elif member_range == 'agent_sas':
-                target_cells = ranges['agent_special']
-                for target_cell in target_cells:
-                    if not target_cell.value or target_cell.value.strip() == "":
-                        member_cell.value = ""
-                        target_cell.value = discord_id
-                        sheet.update_cells([member_cell, target_cell])
-                        batch_data = [
-                            {'range': member_cell.address, 'values': [[""]]},
-                            {'range': target_cell.address, 'values': [[discord_id]]}
-                        ]
-                        sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                        
-                        # Get callsign from column D
-                        callsign = sheet.cell(target_cell.row, 4).value or "N/A"
-                        return True, f"Membru mutat la AGENT SPECIAL: {callsign}"
-                return False, "Nu există poziții libere în AGENT SPECIAL (B18:B21)"
-        
+            if idx == 0:
+                return False, f"Membrul este deja la {SAS_RANK_LABELS[rank]} (cel mai înalt rang)"
+            return sas_roster.move(discord_id, SAS_RANK_ORDER[idx - 1])
         elif direction == 'down':
-            if member_range == 'agent_sas':
-                return False, "Membrul este deja la AGENT S.A.S (cel mai jos rang)"
-            
-            elif member_range == 'coordonator_sas':
-                target_cells = ranges['coordonator_teste']
-                for target_cell in target_cells:
-                    if not target_cell.value or target_cell.value.strip() == "":
-                        member_cell.value = ""
-                        target_cell.value = discord_id
-                        sheet.update_cells([member_cell, target_cell])
-                        batch_data = [
-                            {'range': member_cell.address, 'values': [[""]]},
-                            {'range': target_cell.address, 'values': [[discord_id]]}
-                        ]
-                        sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                        
-                        # Get callsign from column D
-                        callsign = sheet.cell(target_cell.row, 4).value or "N/A"
-                        return True, f"Membru mutat la Coordonator SAS - TESTE: {callsign}"
-                return False, "Nu există poziții libere în Coordonator SAS - TESTE (B14:B16)"
-            
-            elif member_range == 'coordonator_teste':
-                target_cells = ranges['agent_special']
-                for target_cell in target_cells:
-                    if not target_cell.value or target_cell.value.strip() == "":
-                        member_cell.value = ""
-                        target_cell.value = discord_id
-                        sheet.update_cells([member_cell, target_cell])
-                        batch_data = [
-                            {'range': member_cell.address, 'values': [[""]]},
-                            {'range': target_cell.address, 'values': [[discord_id]]}
-                        ]
-                        sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                        
-                        # Get callsign from column D
-                        callsign = sheet.cell(target_cell.row, 4).value or "N/A"
-                        return True, f"Membru mutat la AGENT SPECIAL: {callsign}"
-                return False, "Nu există poziții libere în AGENT SPECIAL (B18:B21)"
-            
-            elif member_range == 'agent_special':
-                target_cells = ranges['agent_sas']
-                for target_cell in target_cells:
-                    if not target_cell.value or target_cell.value.strip() == "":
-                        member_cell.value = ""
-                        target_cell.value = discord_id
-                        sheet.update_cells([member_cell, target_cell])
-                        batch_data = [
-                            {'range': member_cell.address, 'values': [[""]]},
-                            {'range': target_cell.address, 'values': [[discord_id]]}
-                        ]
-                        sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                        
-                        # Get callsign from column D
-                        callsign = sheet.cell(target_cell.row, 4).value or "N/A"
-                        return True, f"Membru mutat la AGENT S.A.S: {callsign}"
-                return False, "Nu există poziții libere în AGENT S.A.S (B23:B40)"
-        
+            if idx == len(SAS_RANK_ORDER) - 1:
+                return False, f"Membrul este deja la {SAS_RANK_LABELS[rank]} (cel mai jos rang)"
+            return sas_roster.move(discord_id, SAS_RANK_ORDER[idx + 1])
         return False, "Direcție invalidă"
     except Exception as e:
+        sas_roster.invalidate()
         logging.error(f"Error moving member in SAS excel: {e}")
         return False, f"Eroare: {str(e)}"
     
 
+def find_member_range_in_sas_excel(discord_id: str) -> str | None:
+    """Name of the SAS rank range holding discord_id, or None."""
+    sas_roster.ensure()
+    return sas_roster.rank_of(discord_id)
+
 def remove_member_from_sas_excel(discord_id: str) -> tuple[bool, str]:
     """
     Remove member from SAS excel.
     Returns (success, message).
     """
     try:
-        client = get_google_sheets_client()
-        sheet = client.open_by_key(SAS_SPREADSHEET_ID).sheet1
+        sas_roster.refresh()
 
-        # Get range B7:B46
-        cells = sheet.range('B7:B46')
-        
-        # Find and clear member
-        found = False
-        for cell in cells:
-            if cell.value == discord_id:
-                cell.value = ""
-                sheet.update_cells([cell])
-                found = True
-                return True, f"Membru șters de la poziția {cell.address}"
-        
-        if not found:
+        # Find (in B7:B46) and clear member
+        row = sas_roster.row_of(discord_id)
+        if row is None:
             return False, "Membrul nu a fost găsit în listă"
+        if sas_roster.write({row: ""})[row] == SHEETS_PENDING:
+            return True, f"Membru șters de la poziția B{row} ({SHEETS_PENDING})"
+        return True, f"Membru șters de la poziția B{row}"
     except Exception as e:
+        sas_roster.invalidate()
         logging.error(f"Error removing member from SAS excel: {e}")
         return False, f"Eroare: {str(e)}"
 
@@ -857,11 +1644,8 @@ class ReportUserChoiceView(discord.ui.View):
 
     @discord.ui.button(label="Toți", style=discord.ButtonStyle.success, custom_id="report_all_btn")
     async def all_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
-        title, lines = build_day_report(self.date_str, interaction.guild, is_sas=self.is_sas)
-        await interaction.response.edit_message(
-            embed=make_embed(title, "\n".join(lines)[:3900], discord.Color.green(), interaction.user),
-            view=None
-        )
+        view = DayReportPagesView(self.date_str, self.requester_id, is_sas=self.is_sas)
+        await view.show(interaction)
         try:
             await log_command(interaction, "day-report-all", changed=False, extra=f"date={self.date_str}")
         except Exception:
@@ -876,6 +1660,65 @@ class ReportUserChoiceView(discord.ui.View):
             view=view
         )
 
+class DayReportPagesView(discord.ui.View):
+    """Day report for all members, one page at a time; the full report is available as a file."""
+    def __init__(self, date_str: str, requester_id: int, *, is_sas: bool = False):
+        super().__init__(timeout=300)
+        self.date_str = date_str
+        self.requester_id = requester_id
+        self.is_sas = is_sas
+        self.page_starts: list[tuple | None] = [None]  # keyset cursor each visited page starts after
+        self.next_cursor: tuple | None = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.requester_id:
+            await interaction.response.send_message("Nu este sesiunea ta.", ephemeral=True)
+            return False
+        return True
+
+    async def show(self, interaction: discord.Interaction):
+        page = len(self.page_starts)
+        lines, self.next_cursor = await build_day_report_page(
+            self.date_str, interaction.guild, is_sas=self.is_sas, after=self.page_starts[-1]
+        )
+        if not lines:
+            lines = ["Fără date."]
+        self.prev_btn.disabled = page == 1
+        self.next_btn.disabled = self.next_cursor is None
+        title = f"Raport {self.date_str} (toți) - Pagina {page}"
+        await interaction.response.edit_message(
+            embed=make_embed(title, "\n".join(lines), discord.Color.green(), interaction.user),
+            view=self
+        )
+
+    @discord.ui.button(label="◀ Înapoi", style=discord.ButtonStyle.secondary, custom_id="day_report_prev_btn")
+    async def prev_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.page_starts) > 1:
+            self.page_starts.pop()
+        await self.show(interaction)
+
+    @discord.ui.button(label="Înainte ▶", style=discord.ButtonStyle.secondary, custom_id="day_report_next_btn")
+    async def next_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.next_cursor is not None:
+            self.page_starts.append(self.next_cursor)
+        await self.show(interaction)
+
+    @discord.ui.button(label="Descarcă tot", style=discord.ButtonStyle.primary, custom_id="day_report_file_btn")
+    async def file_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=True)
+        title, lines = await build_day_report(self.date_str, interaction.guild, is_sas=self.is_sas)
+        body = await report_pool.run(render_day_file, title, lines, local_now().strftime('%d/%m/%Y %H:%M:%S'))
+        file_buffer = io.BytesIO(body)
+        dept = "SAS" if self.is_sas else "PD"
+        await interaction.followup.send(
+            file=discord.File(file_buffer, filename=f"Raport_{dept}_{self.date_str}.txt"),
+            ephemeral=True
+        )
+        try:
+            await log_command(interaction, "day-report-file", changed=False, extra=f"date={self.date_str}")
+        except Exception:
+            pass
+
 class UserSelect(discord.ui.UserSelect):
     def __init__(self, parent: "ReportPickUserView"):
         super().__init__(placeholder="Selectează un user", min_values=1, max_values=1)
@@ -886,7 +1729,7 @@ class UserSelect(discord.ui.UserSelect):
             await interaction.response.send_message("Nu este sesiunea ta.", ephemeral=True)
             return
         member = self.values[0]
-        title, lines = build_day_report(self.parent_view.date_str, interaction.guild, member, is_sas=self.parent_view.is_sas)
+        title, lines = await build_day_report(self.parent_view.date_str, interaction.guild, member, is_sas=self.parent_view.is_sas)
         await interaction.response.edit_message(
             embed=make_embed(title, "\n".join(lines)[:3900], discord.Color.green(), interaction.user),
             view=None
@@ -949,10 +1792,7 @@ class MyPontajeModal(discord.ui.Modal, title="Pontajele mele - Zi"):
                 ephemeral=True
             )
             return
-        if(self.is_sas):
-            sessions = get_clock_times_sas(self.user.id, date_str)
-        else:
-            sessions = get_clock_times(self.user.id, date_str)
+        sessions = await adb.read(get_clock_times, self.user.id, date_str, dept=_dept(self.is_sas))
         if not sessions:
             await interaction.response.send_message(
                 embed=make_embed("Pontajele mele", f"{date_str}\nFără sesiuni.", discord.Color.orange(), interaction.user),
@@ -972,10 +1812,7 @@ class MyPontajeModal(discord.ui.Modal, title="Pontajele mele - Zi"):
             ci_s, co_s = s[0], s[1]
             if ci_s:
                 if co_s:
-                    ci = parse_local(date_str, ci_s)
-                    co = parse_local(date_str, co_s)
-                    mins = (co - ci).total_seconds() / 60
-                    r = round_minutes(mins)
+                    r = s[2] or 0
                     if r > 0:
                         total += r
                     lines.append(f"{idx}. {ci_s} - {co_s} ({int(r)} min)")
@@ -1047,30 +1884,28 @@ class ClockButtons(discord.ui.View):
             )
             return
         date_str = now.strftime("%Y-%m-%d")
-        sessions = get_clock_times(user_id, date_str)
-        for s in sessions:
-            if s[1] is None:
-                await interaction.followup.send(
-                    embed=make_embed("Activ", f"Deja pornit la {s[0]}. Apasă Clock OUT.", discord.Color.orange(), interaction.user),
-                    ephemeral=True
-                )
-                return
         try:
-            add_clock_in(user_id, date_str, now.strftime("%H:%M:%S"))
+            existing = await adb.write(try_clock_in, user_id, date_str, now.strftime("%H:%M:%S"))
         except sqlite3.OperationalError as e:
             if "database or disk is full" in str(e).lower():
                 # try to reclaim space and retry once
                 try:
-                    checkpoint_and_vacuum()
-                    add_clock_in(user_id, date_str, now.strftime("%H:%M:%S"))
+                    await adb.write_exclusive(reclaim_space)
+                    existing = await adb.write(try_clock_in, user_id, date_str, now.strftime("%H:%M:%S"))
                 except Exception:
                     await interaction.followup.send(
-                        embed=make_embed("Stocare plină", "Nu se poate salva în DB. Rulează VACUUM sau eliberează spațiu.", discord.Color.red(), interaction.user),
+                        embed=make_embed("Stocare plină", "Nu se poate salva în DB. Rulează !dbv sau eliberează spațiu.", discord.Color.red(), interaction.user),
                         ephemeral=True
                     )
                     return
             else:
                 raise
+        if existing is not None:
+            await interaction.followup.send(
+                embed=make_embed("Activ", f"Deja pornit la {existing}. Apasă Clock OUT.", discord.Color.orange(), interaction.user),
+                ephemeral=True
+            )
+            return
         await interaction.followup.send(
             embed=make_embed("Clock IN", f"Start {now.strftime('%H:%M:%S')} ({date_str})", discord.Color.green(), interaction.user),
             ephemeral=True
@@ -1090,27 +1925,24 @@ class ClockButtons(discord.ui.View):
         user_id = interaction.user.id
         now = local_now()
         date_str = now.strftime("%Y-%m-%d")
-        sessions = get_clock_times(user_id, date_str)
-        for s in sessions:
-            if s[1] is None:
-                update_clock_out(user_id, date_str, now.strftime("%H:%M:%S"))
-                start_dt = parse_local(date_str, s[0])
-                mins = minutes_diff(start_dt, now)
-                rounded = round_minutes(mins)
-                await interaction.followup.send(
-                    embed=make_embed("Clock OUT", f"Stop {now.strftime('%H:%M:%S')}\nDurată: {rounded} minute", discord.Color.green(), interaction.user),
-                    ephemeral=True
+        closed = await adb.write(try_clock_out, user_id, date_str, now.strftime("%H:%M:%S"))
+        if closed is not None:
+            start, duration = closed
+            rounded = duration or 0  # as stored: elapsed time, also across DST changes
+            await interaction.followup.send(
+                embed=make_embed("Clock OUT", f"Stop {now.strftime('%H:%M:%S')}\nDurată: {rounded} minute", discord.Color.green(), interaction.user),
+                ephemeral=True
+            )
+            try:
+                await log_command(
+                    interaction,
+                    "clockout-button",
+                    changed=True,
+                    extra=f"start={start} end={now.strftime('%H:%M:%S')} mins={rounded}"
                 )
-                try:
-                    await log_command(
-                        interaction,
-                        "clockout-button",
-                        changed=True,
-                        extra=f"start={s[0]} end={now.strftime('%H:%M:%S')} mins={rounded}"
-                    )
-                except Exception:
-                    pass
-                return
+            except Exception:
+                pass
+            return
         await interaction.followup.send(
             embed=make_embed("Fără sesiune", "Nu ai sesiune activă.", discord.Color.orange(), interaction.user),
             ephemeral=True
@@ -1157,12 +1989,11 @@ class HrButtons(discord.ui.View):
         today = local_now().strftime("%Y-%m-%d")
         lines = []
         total = 0
-        for uid, date_val, ci in get_ongoing_sessions():
-            if date_val == today:  # only today
-                member = interaction.guild.get_member(uid) if interaction.guild else None
-                name = member.display_name if member else str(uid)
-                lines.append(f"{name} - {ci}")
-                total += 1
+        for uid, date_val, ci in await _open_sessions(DEPT_PD, today):  # only today
+            member = interaction.guild.get_member(uid) if interaction.guild else None
+            name = member.display_name if member else str(uid)
+            lines.append(f"{name} - {ci}")
+            total += 1
         if not lines:
             desc = "Nu există sesiuni active azi."
         else:
@@ -1200,7 +2031,7 @@ class HrButtons(discord.ui.View):
             )
             return
         today = local_now().strftime("%Y-%m-%d")
-        sessions = [(uid, date_val, ci) for uid, date_val, ci in get_ongoing_sessions() if date_val == today]
+        sessions = await _open_sessions(DEPT_PD, today)
         if not sessions:
             await interaction.response.send_message(
                 embed=make_embed("Opreste Pontaje", "Nu există sesiuni active azi.", discord.Color.blue(), interaction.user),
@@ -1273,10 +2104,72 @@ class HrButtons(discord.ui.View):
                 view=view,
                 ephemeral=True
             )
-        try:
-            await log_command(interaction, "pontaje", changed=False, extra=f"month={now.month} year={now.year}")
-        except Exception:
-            pass
+        try:
+            await log_command(interaction, "pontaje", changed=False, extra=f"month={now.month} year={now.year}")
+        except Exception:
+            pass
+
+    @discord.ui.button(label="Pontaje / Săptămânale", style=discord.ButtonStyle.grey, custom_id="week_report_pd_btn")
+    async def week_report_pd_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not await self._check_basic(interaction):
+            return
+        if not is_mgmt(interaction.user):
+            await interaction.response.send_message(
+                embed=make_embed("Permisiune", "Necesită HR sau Conducere.", discord.Color.red(), interaction.user),
+                ephemeral=True
+            )
+            return
+        view = WeekSelectionView(interaction.user.id, is_sas=False)
+        await interaction.response.send_message(
+            embed=make_embed(
+                "Selectează Săptămâna",
+                "Alege săptămâna pentru raport:",
+                discord.Color.blurple(),
+                interaction.user
+            ),
+            view=view,
+            ephemeral=True
+        )
+        try:
+            await log_command(interaction, "week-report-pd-open", changed=False)
+        except Exception:
+            pass
+
+    @discord.ui.button(label="Export Lunar", style=discord.ButtonStyle.grey, custom_id="month_export_btn")
+    async def month_export_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not await self._check_basic(interaction):
+            return
+        if not is_mgmt(interaction.user):
+            await interaction.response.send_message(
+                embed=make_embed("Permisiune", "Necesită HR sau Conducere.", discord.Color.red(), interaction.user),
+                ephemeral=True
+            )
+            return
+        await interaction.response.send_modal(MonthExportModal())
+
+    @discord.ui.button(label="Analiză Prezență", style=discord.ButtonStyle.grey, custom_id="staffing_report_btn")
+    async def staffing_report_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not await self._check_basic(interaction):
+            return
+        if not is_mgmt(interaction.user):
+            await interaction.response.send_message(
+                embed=make_embed("Permisiune", "Necesită HR sau Conducere.", discord.Color.red(), interaction.user),
+                ephemeral=True
+            )
+            return
+        await interaction.response.send_modal(StaffingModal())
+
+    @discord.ui.button(label="Top 10", style=discord.ButtonStyle.grey, custom_id="leaderboard_pd_btn")
+    async def leaderboard_pd_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not await self._check_basic(interaction):
+            return
+        if not is_mgmt(interaction.user):
+            await interaction.response.send_message(
+                embed=make_embed("Permisiune", "Necesită HR sau Conducere.", discord.Color.red(), interaction.user),
+                ephemeral=True
+            )
+            return
+        await LeaderboardView(interaction.user.id, is_sas=False).show(interaction, "week", edit=False)
     
     @discord.ui.button(label="Adaugă Minute", style=discord.ButtonStyle.grey, custom_id="add_minutes_btn")
     async def add_minutes_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -1372,29 +2265,28 @@ class SASClockButtons(discord.ui.View):
             )
             return
         date = now.strftime("%Y-%m-%d")
-        sessions = get_clock_times_sas(uid, date)
-        if any(s[1] is None for s in sessions):
-            await interaction.followup.send(
-                embed=make_embed("Activ", "Deja ai o sesiune SAS. Apasă SAS OUT.", discord.Color.orange(), interaction.user),
-                ephemeral=True
-            )
-            return
         try:
-            add_clock_in_sas(uid, date, now.strftime("%H:%M:%S"))
+            existing = await adb.write(try_clock_in, uid, date, now.strftime("%H:%M:%S"), dept=DEPT_SAS)
         except sqlite3.OperationalError as e:
             if "database or disk is full" in str(e).lower():
                 # try to reclaim space and retry once
                 try:
-                    checkpoint_and_vacuum()
-                    add_clock_in_sas(uid, date, now.strftime("%H:%M:%S"))
+                    await adb.write_exclusive(reclaim_space)
+                    existing = await adb.write(try_clock_in, uid, date, now.strftime("%H:%M:%S"), dept=DEPT_SAS)
                 except Exception:
                     await interaction.followup.send(
-                        embed=make_embed("Stocare plină", "Nu se poate salva în DB. Rulează VACUUM sau eliberează spațiu.", discord.Color.red(), interaction.user),
+                        embed=make_embed("Stocare plină", "Nu se poate salva în DB. Rulează !dbv sau eliberează spațiu.", discord.Color.red(), interaction.user),
                         ephemeral=True
                     )
                     return
             else:
                 raise
+        if existing is not None:
+            await interaction.followup.send(
+                embed=make_embed("Activ", "Deja ai o sesiune SAS. Apasă SAS OUT.", discord.Color.orange(), interaction.user),
+                ephemeral=True
+            )
+            return
         await interaction.followup.send(
             embed=make_embed("SAS IN", f"Start {now.strftime('%H:%M:%S')} ({date})", discord.Color.green(), interaction.user),
             ephemeral=True
@@ -1411,24 +2303,21 @@ class SASClockButtons(discord.ui.View):
         uid = interaction.user.id
         now = local_now()
         date = now.strftime("%Y-%m-%d")
-        sessions = get_clock_times_sas(uid, date)
-        for s in sessions:
-            if s[1] is None:
-                update_clock_out_sas(uid, date, now.strftime("%H:%M:%S"))
-                start_dt = parse_local(date, s[0])
-                mins = minutes_diff(start_dt, now)
-                rounded = round_minutes(mins)
-                await interaction.followup.send(
-                    embed=make_embed("SAS OUT", f"Stop {now.strftime('%H:%M:%S')}\nDurată: {rounded} minute", discord.Color.green(), interaction.user),
-                    ephemeral=True
-                )
-                await log_command(
-                    interaction,
-                    "sasclockout-button",
-                    changed=True,
-                    extra=f"start={s[0]} end={now.strftime('%H:%M:%S')} mins={rounded}"
-                )
-                return
+        closed = await adb.write(try_clock_out, uid, date, now.strftime("%H:%M:%S"), dept=DEPT_SAS)
+        if closed is not None:
+            start, duration = closed
+            rounded = duration or 0
+            await interaction.followup.send(
+                embed=make_embed("SAS OUT", f"Stop {now.strftime('%H:%M:%S')}\nDurată: {rounded} minute", discord.Color.green(), interaction.user),
+                ephemeral=True
+            )
+            await log_command(
+                interaction,
+                "sasclockout-button",
+                changed=True,
+                extra=f"start={start} end={now.strftime('%H:%M:%S')} mins={rounded}"
+            )
+            return
         await interaction.followup.send(
             embed=make_embed("Fără sesiune", "Nu ai sesiune SAS activă.", discord.Color.orange(), interaction.user),
             ephemeral=True
@@ -1480,12 +2369,11 @@ class SASCoordonatorButtons(discord.ui.View):
         today = local_now().strftime("%Y-%m-%d")
         lines = []
         total = 0
-        for uid, date_val, ci in get_ongoing_sessions_sas():
-            if date_val == today:  # only today
-                member = interaction.guild.get_member(uid) if interaction.guild else None
-                name = member.display_name if member else str(uid)
-                lines.append(f"{name} - {ci}")
-                total += 1
+        for uid, date_val, ci in await _open_sessions(DEPT_SAS, today):  # only today
+            member = interaction.guild.get_member(uid) if interaction.guild else None
+            name = member.display_name if member else str(uid)
+            lines.append(f"{name} - {ci}")
+            total += 1
         if not lines:
             desc = "Nu există sesiuni active azi."
         else:
@@ -1523,7 +2411,7 @@ class SASCoordonatorButtons(discord.ui.View):
             )
             return
         today = local_now().strftime("%Y-%m-%d")
-        sessions = [(uid, date_val, ci) for uid, date_val, ci in get_ongoing_sessions_sas() if date_val == today]
+        sessions = await _open_sessions(DEPT_SAS, today)
         if not sessions:
             await interaction.response.send_message(
                 embed=make_embed("Opreste Pontaje", "Nu există sesiuni active azi.", discord.Color.blue(), interaction.user),
@@ -1613,7 +2501,7 @@ class SASCoordonatorButtons(discord.ui.View):
             return
         
         # Show week selection view instead of generating report immediately
-        view = WeekSelectionView(interaction.user.id)
+        view = WeekSelectionView(interaction.user.id, is_sas=True)
         await interaction.response.send_message(
             embed=make_embed(
                 "Selectează Săptămâna",
@@ -1625,11 +2513,18 @@ class SASCoordonatorButtons(discord.ui.View):
             ephemeral=True
         )
 
+    @discord.ui.button(label="Top 10", style=discord.ButtonStyle.grey, custom_id="leaderboard_sas_btn")
+    async def leaderboard_sas_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not await self._check_basic(interaction):
+            return
+        await LeaderboardView(interaction.user.id, is_sas=True).show(interaction, "week", edit=False)
+
 class WeekSelectionView(discord.ui.View):
-    """View to select current or previous week for weekly report."""
-    def __init__(self, requester_id: int):
+    """View to select current / previous week (or the last 4 weeks) for the weekly report."""
+    def __init__(self, requester_id: int, *, is_sas: bool = False):
         super().__init__(timeout=180)
         self.requester_id = requester_id
+        self.is_sas = is_sas
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.requester_id:
@@ -1645,51 +2540,58 @@ class WeekSelectionView(discord.ui.View):
     async def previous_week_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self._generate_week_report(interaction, weeks_ago=1)
 
-    async def _generate_week_report(self, interaction: discord.Interaction, weeks_ago: int):
+    @discord.ui.button(label="Ultimele 4 Săptămâni", style=discord.ButtonStyle.secondary, custom_id="last_4_weeks_btn")
+    async def last_4_weeks_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._generate_week_report(interaction, weeks_ago=0, weeks=4)
+
+    async def _generate_week_report(self, interaction: discord.Interaction, weeks_ago: int, weeks: int = 1):
         # Defer response as this might take time
         await interaction.response.defer(ephemeral=True)
         
-        # Calculate the reference date
+        # Calculate the reference date; with weeks > 1 the range ends with that week (oldest first)
         reference_date = local_now() - datetime.timedelta(weeks=weeks_ago)
+        dates = []
+        for k in range(weeks - 1, -1, -1):
+            dates.extend(_get_week_dates(reference_date - datetime.timedelta(weeks=k))[1])
+        first, last = datetime.date.fromisoformat(dates[0]), datetime.date.fromisoformat(dates[-1])
+        week_label = f"{first.strftime('%d.%m')} - {last.strftime('%d.%m.%Y')}"
+        dept = "SAS" if self.is_sas else "PD"
+        members = _week_report_members(interaction.guild, is_sas=self.is_sas)
         
-        week_label, week_dates = _get_week_dates(reference_date)
-        lines = build_week_report_sas(interaction.guild, week_dates)
-        
-        # Create well-formatted .txt file content
-        report_lines = []
-        
-        # Add header with title and date range
-        report_lines.append("=" * 80)
-        report_lines.append(f"RAPORT SĂPTĂMÂNAL SAS - {week_label}".center(80))
-        report_lines.append("=" * 80)
-        report_lines.append("")
-        
-        # Add the table (already formatted from build_week_report_sas)
-        report_lines.extend(lines)
+        # Rendered header + table are cached (as file bytes) until a write touches the range
+        key = ("week", _dept(self.is_sas), dates[0], dates[-1], member_index.version(interaction.guild, _dept_roles(self.is_sas)))
+        cached = report_cache.get(key)
+        if cached is None:
+            generation = report_cache.generation()
+            # Header + table, rendered on the report pool
+            cached = await build_week_report_file(
+                interaction.guild, dates, f"RAPORT SĂPTĂMÂNAL {dept} - {week_label}", is_sas=self.is_sas, members=members
+            )
+            report_cache.put(key, cached, len(cached[1]), [m.id for m in members], generation)
+        member_count, body = cached
         
         # Add footer with generation info
+        report_lines = []
         report_lines.append("")
         report_lines.append("-" * 80)
         report_lines.append(f"Generat la: {local_now().strftime('%d/%m/%Y %H:%M:%S')}")
         report_lines.append(f"Generat de: {interaction.user.display_name}")
-        report_lines.append(f"Total membri: {len(lines) - 2}")  # Exclude header + separator
+        report_lines.append(f"Total membri: {member_count}")
         report_lines.append("=" * 80)
         
-        report_text = "\n".join(report_lines)
-        
         # Create file buffer with UTF-8 encoding (with BOM for better Windows compatibility)
-        file_buffer = io.BytesIO(report_text.encode('utf-8-sig'))
+        file_buffer = io.BytesIO(body + ("\n" + "\n".join(report_lines)).encode("utf-8"))
         file_buffer.seek(0)
         
         # Create Discord file
-        filename = f"Raport_SAS_{week_label.replace(' ', '_').replace('.', '_')}.txt"
+        filename = f"Raport_{dept}_{week_label.replace(' ', '_').replace('.', '_')}.txt"
         discord_file = discord.File(file_buffer, filename=filename)
         
         # Send file
         await interaction.followup.send(
             embed=make_embed(
-                f"📊 Raport Săptămânal SAS - {week_label}",
-                f"**Raport generat pentru {len(lines) - 2} membri.**\n\n"
+                f"📊 Raport Săptămânal {dept} - {week_label}",
+                f"**Raport generat pentru {member_count} membri.**\n\n"
                 f"Descarcă fișierul `.txt` de mai jos pentru a vizualiza raportul formatat.\n"
                 f"📁 Poate fi deschis în Notepad, Excel, sau orice editor de text.",
                 discord.Color.green(),
@@ -1702,10 +2604,207 @@ class WeekSelectionView(discord.ui.View):
         try:
             await log_command(
                 interaction,
-                "week-report-sas",
+                f"week-report-{dept.lower()}",
                 changed=False,
-                extra=f"week={week_label} weeks_ago={weeks_ago} format=txt members={len(lines)-2}"
+                extra=f"week={week_label} weeks_ago={weeks_ago} weeks={weeks} format=txt members={member_count}"
+            )
+        except Exception:
+            pass
+
+class MonthExportModal(discord.ui.Modal, title="Export Lunar"):
+    def __init__(self):
+        super().__init__(timeout=300)
+        now = local_now()
+        self.month_input = discord.ui.TextInput(
+            label="Luna (YYYY-MM)",
+            default=now.strftime("%Y-%m"),
+            max_length=7,
+            required=True
+        )
+        self.format_input = discord.ui.TextInput(
+            label="Format (csv / xlsx)",
+            default="csv",
+            max_length=4,
+            required=True
+        )
+        self.dept_input = discord.ui.TextInput(
+            label="Departament (PD / SAS / toate)",
+            default="toate",
+            max_length=5,
+            required=True
+        )
+        self.add_item(self.month_input)
+        self.add_item(self.format_input)
+        self.add_item(self.dept_input)
+
+    async def on_submit(self, interaction: discord.Interaction):
+        if not is_mgmt(interaction.user):
+            await interaction.response.send_message("Permisiune refuzată.", ephemeral=True)
+            return
+        fmt = self.format_input.value.strip().lower()
+        dept_raw = self.dept_input.value.strip().upper()
+        try:
+            first = datetime.datetime.strptime(self.month_input.value.strip(), "%Y-%m").date()
+        except ValueError:
+            await interaction.response.send_message(
+                embed=make_embed("Lună invalidă", "Folosește formatul YYYY-MM.", discord.Color.red(), interaction.user),
+                ephemeral=True
+            )
+            return
+        if fmt not in ("csv", "xlsx") or dept_raw not in ("PD", "SAS", "TOATE"):
+            await interaction.response.send_message(
+                embed=make_embed("Date invalide", "Format: csv / xlsx. Departament: PD / SAS / toate.", discord.Color.red(), interaction.user),
+                ephemeral=True
+            )
+            return
+        await interaction.response.defer(ephemeral=True)
+
+        dept = None if dept_raw == "TOATE" else (DEPT_SAS if dept_raw == "SAS" else DEPT_PD)
+        dept_label = "Toate" if dept is None else dept_raw
+        last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+        names = {m.id: m.display_name for m in interaction.guild.members} if interaction.guild else {}
+        filename = f"Pontaje_{dept_label}_{first.strftime('%Y_%m')}.{fmt}"
+        try:
+            data, rows = await adb.read(_write_month_export, fmt, first.isoformat(), last.isoformat(), dept, names)
+        except ImportError:
+            await interaction.followup.send(
+                embed=make_embed("XLSX indisponibil", "openpyxl nu este instalat pe bot. Folosește csv.", discord.Color.orange(), interaction.user),
+                ephemeral=True
+            )
+            return
+
+        limit = interaction.guild.filesize_limit if interaction.guild else 8 * 1024 * 1024
+        compressed = False
+        if fmt == "csv" and _file_size(data) > limit:
+            data, filename = await asyncio.to_thread(_compress_export, data, filename)
+            compressed = True
+        size = _file_size(data)
+        if size > limit:
+            data.close()
+            hint = "Exportă pe departament." if dept is None else ("Folosește csv (se comprimă)." if fmt == "xlsx" else "")
+            await interaction.followup.send(
+                embed=make_embed("Export prea mare", f"{size // 1024} KB{' comprimat' if compressed else ''} depășește limita serverului ({limit // 1024} KB). {hint}".rstrip(), discord.Color.red(), interaction.user),
+                ephemeral=True
+            )
+            return
+        try:
+            await interaction.followup.send(
+                embed=make_embed(
+                    f"📁 Export {dept_label} - {first.strftime('%m.%Y')}",
+                    f"{rows} rânduri ({size // 1024} KB{', comprimat' if compressed else ''}).",
+                    discord.Color.green(),
+                    interaction.user
+                ),
+                file=discord.File(data, filename=filename),
+                ephemeral=True
+            )
+        finally:
+            data.close()
+        try:
+            await log_command(interaction, "export-lunar", changed=False, extra=f"month={first.strftime('%Y-%m')} dept={dept_raw} format={fmt} rows={rows} bytes={size}")
+        except Exception:
+            pass
+
+class LeaderboardView(discord.ui.View):
+    """Top members by minutes for the current week / month, in one embed."""
+    def __init__(self, requester_id: int, *, is_sas: bool = False):
+        super().__init__(timeout=180)
+        self.requester_id = requester_id
+        self.is_sas = is_sas
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.requester_id:
+            await interaction.response.send_message("Nu este sesiunea ta.", ephemeral=True)
+            return False
+        return True
+
+    async def show(self, interaction: discord.Interaction, period: str, *, edit: bool = True):
+        title, desc = await build_leaderboard(interaction.guild, period, is_sas=self.is_sas)
+        embed = make_embed(title, desc, discord.Color.gold(), interaction.user)
+        if edit:
+            await interaction.response.edit_message(embed=embed, view=self)
+        else:
+            await interaction.response.send_message(embed=embed, view=self, ephemeral=True)
+        try:
+            await log_command(interaction, "leaderboard", changed=False, extra=f"period={period} dept={'SAS' if self.is_sas else 'PD'}")
+        except Exception:
+            pass
+
+    @discord.ui.button(label="Săptămâna Aceasta", style=discord.ButtonStyle.primary, custom_id="leaderboard_week_btn")
+    async def week_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, "week")
+
+    @discord.ui.button(label="Luna Aceasta", style=discord.ButtonStyle.secondary, custom_id="leaderboard_month_btn")
+    async def month_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, "month")
+
+class StaffingModal(discord.ui.Modal, title="Analiză Prezență"):
+    def __init__(self):
+        super().__init__(timeout=300)
+        self.date_input = discord.ui.TextInput(
+            label="Prima zi (YYYY-MM-DD)",
+            default=local_now().strftime("%Y-%m-%d"),
+            max_length=10,
+            required=True
+        )
+        self.days_input = discord.ui.TextInput(
+            label="Număr zile (1-31)",
+            default="1",
+            max_length=2,
+            required=True
+        )
+        self.min_input = discord.ui.TextInput(
+            label="Minim oameni în tură",
+            default="3",
+            max_length=3,
+            required=True
+        )
+        self.dept_input = discord.ui.TextInput(
+            label="Departament (PD / SAS)",
+            default="PD",
+            max_length=3,
+            required=True
+        )
+        self.add_item(self.date_input)
+        self.add_item(self.days_input)
+        self.add_item(self.min_input)
+        self.add_item(self.dept_input)
+
+    async def on_submit(self, interaction: discord.Interaction):
+        if not is_mgmt(interaction.user):
+            await interaction.response.send_message("Permisiune refuzată.", ephemeral=True)
+            return
+        dept_raw = self.dept_input.value.strip().upper()
+        try:
+            first = datetime.date.fromisoformat(self.date_input.value.strip())
+            days = int(self.days_input.value.strip())
+            min_headcount = int(self.min_input.value.strip())
+        except ValueError:
+            first = None
+        if first is None or not 1 <= days <= 31 or min_headcount < 0 or dept_raw not in ("PD", "SAS"):
+            await interaction.response.send_message(
+                embed=make_embed("Date invalide", "Data: YYYY-MM-DD. Zile: 1-31. Minim: număr. Departament: PD / SAS.", discord.Color.red(), interaction.user),
+                ephemeral=True
             )
+            return
+        await interaction.response.defer(ephemeral=True)
+
+        last = first + datetime.timedelta(days=days - 1)
+        window_start, window_end = local_day_window(first.isoformat(), last.isoformat(), LOCAL_TZ)
+        now = int(time.time())
+        window_end = min(window_end, max(now, window_start))  # the future is not "below minimum"
+        starts, ends = await adb.read(get_session_spans, window_start, window_end, _dept(dept_raw == "SAS"))
+        stats = await asyncio.to_thread(
+            staffing_stats, starts, ends, window_start, window_end, LOCAL_TZ,
+            min_headcount=min_headcount, now=now
+        )
+        period = first.strftime("%d.%m.%Y") if days == 1 else f"{first.strftime('%d.%m')} - {last.strftime('%d.%m.%Y')}"
+        await interaction.followup.send(
+            embed=make_embed(f"📈 Prezență {dept_raw} - {period}", _format_staffing(stats, min_headcount), discord.Color.blurple(), interaction.user),
+            ephemeral=True
+        )
+        try:
+            await log_command(interaction, "staffing-report", changed=False, extra=f"from={first} days={days} dept={dept_raw} min={min_headcount}")
         except Exception:
             pass
 
@@ -1887,7 +2986,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     return
                 
                 # Get PD ID from PD excel
-                pd_id = get_pd_id_by_callsign(callsign)
+                pd_id = await sheets.run(get_pd_id_by_callsign, callsign)
                 if not pd_id:
                     await interaction.followup.send(
                         embed=make_embed("Eroare", f"Callsign-ul {callsign} nu a fost găsit în spreadsheet-ul PD.", discord.Color.red(), interaction.user),
@@ -1896,7 +2995,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     return
                 
                 # Add to SAS excel
-                success, message = add_member_to_sas_excel(pd_id)
+                success, message = await sheets.run(add_member_to_sas_excel, pd_id)
                 color = discord.Color.green() if success else discord.Color.red()
                 await interaction.followup.send(
                     embed=make_embed("Add Member" if success else "Eroare", f"{member.mention} ({callsign})\nID PD: {pd_id}\n{message}", color, interaction.user),
@@ -1932,7 +3031,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     )
                     return
                 
-                pd_id = get_pd_id_by_callsign(callsign)
+                pd_id = await sheets.run(get_pd_id_by_callsign, callsign)
                 if not pd_id:
                     await interaction.followup.send(
                         embed=make_embed("Eroare", f"Callsign-ul {callsign} nu a fost găsit în spreadsheet-ul PD.", discord.Color.red(), interaction.user),
@@ -1941,24 +3040,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     return
                 
                 # Find current range
-                client = get_google_sheets_client()
-                sheet = client.open_by_key(SAS_SPREADSHEET_ID).sheet1
-                
-                ranges = {
-                    'coordonator_sas': sheet.range('B11:B12'),
-                    'coordonator_teste': sheet.range('B14:B16'),
-                    'agent_special': sheet.range('B18:B21'),
-                    'agent_sas': sheet.range('B23:B40')
-                }
-                
-                member_range = None
-                for range_name, cells in ranges.items():
-                    for cell in cells:
-                        if cell.value == pd_id:
-                            member_range = range_name
-                            break
-                    if member_range:
-                        break
+                member_range = await sheets.run(find_member_range_in_sas_excel, pd_id)
                 
                 if not member_range:
                     await interaction.followup.send(
@@ -1999,7 +3081,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     )
                     return
                 
-                pd_id = get_pd_id_by_callsign(callsign)
+                pd_id = await sheets.run(get_pd_id_by_callsign, callsign)
                 if not pd_id:
                     await interaction.followup.send(
                         embed=make_embed("Eroare", f"Callsign-ul {callsign} nu a fost găsit în spreadsheet-ul PD.", discord.Color.red(), interaction.user),
@@ -2008,24 +3090,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     return
                 
                 # Find current range
-                client = get_google_sheets_client()
-                sheet = client.open_by_key(SAS_SPREADSHEET_ID).sheet1
-                
-                ranges = {
-                    'coordonator_sas': sheet.range('B11:B12'),
-                    'coordonator_teste': sheet.range('B14:B16'),
-                    'agent_special': sheet.range('B18:B21'),
-                    'agent_sas': sheet.range('B23:B40')
-                }
-                
-                member_range = None
-                for range_name, cells in ranges.items():
-                    for cell in cells:
-                        if cell.value == pd_id:
-                            member_range = range_name
-                            break
-                    if member_range:
-                        break
+                member_range = await sheets.run(find_member_range_in_sas_excel, pd_id)
                 
                 if not member_range:
                     await interaction.followup.send(
@@ -2066,7 +3131,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     )
                     return
                 
-                pd_id = get_pd_id_by_callsign(callsign)
+                pd_id = await sheets.run(get_pd_id_by_callsign, callsign)
                 if not pd_id:
                     await interaction.followup.send(
                         embed=make_embed("Eroare", f"Callsign-ul {callsign} nu a fost găsit în spreadsheet-ul PD.", discord.Color.red(), interaction.user),
@@ -2075,7 +3140,7 @@ class SASMemberUserSelect(discord.ui.UserSelect):
                     return
                 
                 # Remove member
-                success, message = remove_member_from_sas_excel(pd_id)
+                success, message = await sheets.run(remove_member_from_sas_excel, pd_id)
                 color = discord.Color.green() if success else discord.Color.orange()
                 await interaction.followup.send(
                     embed=make_embed("Remove Member" if success else "Info", f"{member.mention} ({callsign})\n{message}", color, interaction.user),
@@ -2138,43 +3203,15 @@ class SASRoleSelectView(discord.ui.View):
         self.add_item(self.role_select)
     
     def _get_available_roles(self) -> list[tuple[str, str, str]]:
-        """Returns list of (label, value, description) for available promotions/demotions."""
-        if self.is_demotion:
-            # Demotions (reversed)
-            demotions = {
-                'coordonator_sas': [
-                    ('Coordonator SAS - TESTE', 'coordonator_teste', 'B14:B16'),
-                    ('AGENT SPECIAL', 'agent_special', 'B18:B21 - ALPHA/OMEGA/DELTA/TITAN'),
-                    ('AGENT S.A.S', 'agent_sas', 'B23:B40')
-                ],
-                'coordonator_teste': [
-                    ('AGENT SPECIAL', 'agent_special', 'B18:B21 - ALPHA/OMEGA/DELTA/TITAN'),
-                    ('AGENT S.A.S', 'agent_sas', 'B23:B40')
-                ],
-                'agent_special': [
-                    ('AGENT S.A.S', 'agent_sas', 'B23:B40')
-                ],
-                'agent_sas': []  # Already at bottom
-            }
-            return demotions.get(self.current_range, [])
-        else:
-            # Promotions
-            promotions = {
-                'agent_sas': [
-                    ('AGENT SPECIAL', 'agent_special', 'B18:B21 - ALPHA/OMEGA/DELTA/TITAN'),
-                    ('Coordonator SAS - TESTE', 'coordonator_teste', 'B14:B16'),
-                    ('Coordonator SAS', 'coordonator_sas', 'B11:B12')
-                ],
-                'agent_special': [
-                    ('Coordonator SAS - TESTE', 'coordonator_teste', 'B14:B16'),
-                    ('Coordonator SAS', 'coordonator_sas', 'B11:B12')
-                ],
-                'coordonator_teste': [
-                    ('Coordonator SAS', 'coordonator_sas', 'B11:B12')
-                ],
-                'coordonator_sas': []  # Already at top
-            }
-            return promotions.get(self.current_range, [])
+        """Returns list of (label, value, description) for available promotions/demotions, nearest rank first."""
+        if self.current_range not in SAS_RANK_ORDER:
+            return []
+        idx = SAS_RANK_ORDER.index(self.current_range)
+        keys = SAS_RANK_ORDER[idx + 1:] if self.is_demotion else SAS_RANK_ORDER[:idx][::-1]
+        return [
+            (SAS_RANK_LABELS[k], k, _sas_rank_span(k) + (f" - {SAS_RANK_HINTS[k]}" if k in SAS_RANK_HINTS else ""))
+            for k in keys
+        ]
     
     async def role_select_callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.requester_id:
@@ -2195,7 +3232,7 @@ class SASRoleSelectView(discord.ui.View):
             )
             return
         
-        pd_id = get_pd_id_by_callsign(callsign)
+        pd_id = await sheets.run(get_pd_id_by_callsign, callsign)
         if not pd_id:
             await interaction.followup.send(
                 embed=make_embed("Eroare", f"Callsign-ul {callsign} nu a fost găsit în spreadsheet-ul PD.", discord.Color.red(), interaction.user),
@@ -2204,7 +3241,7 @@ class SASRoleSelectView(discord.ui.View):
             return
         
         # Move member to selected range
-        success, message = move_member_to_specific_range(pd_id, target_range)
+        success, message = await sheets.run(move_member_to_specific_range, pd_id, target_range)
         color = discord.Color.green() if success else discord.Color.orange()
         
         await interaction.followup.send(
@@ -2219,13 +3256,7 @@ class SASRoleSelectView(discord.ui.View):
             if SAS_MEMBER_NOTIFICATIONS_CHANNEL_ID:
                 notif_ch = bot.get_channel(SAS_MEMBER_NOTIFICATIONS_CHANNEL_ID)
                 if notif_ch:
-                    role_names = {
-                        'agent_special': 'AGENT SPECIAL',
-                        'coordonator_teste': 'Coordonator SAS - TESTE',
-                        'coordonator_sas': 'Coordonator SAS',
-                        'agent_sas': 'AGENT S.A.S'
-                    }
-                    target_name = role_names.get(target_range, target_range)
+                    target_name = SAS_RANK_LABELS.get(target_range, target_range)
                     emoji = "⬇️" if self.is_demotion else "⬆️"
                     action_text = "Retrogradat" if self.is_demotion else "Promovat"
                     notif_embed = discord.Embed(
@@ -2251,74 +3282,15 @@ class SASRoleSelectView(discord.ui.View):
 def move_member_to_specific_range(discord_id: str, target_range_name: str) -> tuple[bool, str]:
     """
     Move member to a specific target range.
-    target_range_name: 'agent_special', 'coordonator_teste', or 'coordonator_sas'
+    target_range_name: a SAS_RANK_LADDER key ('agent_special', 'coordonator_teste', 'coordonator_sas', ...)
     """
     try:
-        client = get_google_sheets_client()
-        sheet = client.open_by_key(SAS_SPREADSHEET_ID).sheet1
-        
-        ranges = {
-            'coordonator_sas': sheet.range('B11:B12'),
-            'coordonator_teste': sheet.range('B14:B16'),
-            'agent_special': sheet.range('B18:B21'),
-            'agent_sas': sheet.range('B23:B40')
-        }
-        
-        # Find current position
-        member_cell = None
-        for cells in ranges.values():
-            for cell in cells:
-                if cell.value == discord_id:
-                    member_cell = cell
-                    break
-            if member_cell:
-                break
-        
-        if not member_cell:
-            return False, "Membrul nu a fost găsit în niciun interval"
-        
-        # Get target range
-        if target_range_name not in ranges:
+        if target_range_name not in SAS_RANK_ROWS:
             return False, "Rang țintă invalid"
-        
-        target_cells = ranges[target_range_name]
-        
-        # Find empty slot in target range
-        for target_cell in target_cells:
-            if not target_cell.value or target_cell.value.strip() == "":
-                # Move member
-                member_cell.value = ""
-                target_cell.value = discord_id
-                sheet.update_cells([member_cell, target_cell])
-                
-                # Force recalc
-                batch_data = [
-                    {'range': member_cell.address, 'values': [[""]]},
-                    {'range': target_cell.address, 'values': [[discord_id]]}
-                ]
-                sheet.batch_update(batch_data, value_input_option='USER_ENTERED')
-                
-                # Get callsign from column D
-                callsign = sheet.cell(target_cell.row, 4).value or "N/A"
-                
-                role_names = {
-                    'coordonator_sas': 'Coordonator SAS',
-                    'coordonator_teste': 'Coordonator SAS - TESTE',
-                    'agent_special': 'AGENT SPECIAL'
-                }
-                role_name = role_names.get(target_range_name, target_range_name)
-                
-                return True, f"Membru mutat la {role_name}: {callsign}"
-        
-        # No empty slots
-        range_labels = {
-            'coordonator_sas': 'Coordonator SAS (B11:B12)',
-            'coordonator_teste': 'Coordonator SAS - TESTE (B14:B16)',
-            'agent_special': 'AGENT SPECIAL (B18:B21)'
-        }
-        return False, f"Nu există poziții libere în {range_labels.get(target_range_name, target_range_name)}"
-        
+        sas_roster.refresh()
+        return sas_roster.move(discord_id, target_range_name)
     except Exception as e:
+        sas_roster.invalidate()
         logging.error(f"Error moving member to specific range: {e}")
         return False, f"Eroare: {str(e)}"
 
@@ -2491,19 +3463,7 @@ async def _update_action_message(sess: dict):
 def _extract_callsign(member: discord.Member | None) -> str | None:
     if not member:
         return None
-    name = (member.display_name or member.name)
-    m = CALLSIGN_RE.search(name)
-    if not m:
-        return None
-    digits = m.group(1)
-    try:
-        num = int(digits)
-    except ValueError:
-        logging.warning("Invalid callsign digits '%s' in name '%s'", digits, name)
-        return None
-    if num < 1 or num > 99:
-        return None
-    return f"S-{num:02d}"
+    return callsigns.sas(member)
 
 async def _send_callsigns_activity_api(callsigns: set[str]) -> bool:  # NEW
     if not (ACTIVITY_API_URL and ACTIVITY_API_TOKEN and callsigns):
@@ -2550,10 +3510,7 @@ class StopSessionButton(discord.ui.Button):
             await interaction.response.defer()  # not ephemeral; we'll edit the panel message
 
         try:
-            if self.parent_view.is_sas:
-                remove_session_sas(self.target_uid, self.parent_view.day, self.start_time)
-            else:
-                remove_session(self.target_uid, self.parent_view.day, self.start_time)
+            await adb.write(remove_session, self.target_uid, self.parent_view.day, self.start_time, dept=_dept(self.parent_view.is_sas))
             member = interaction.guild.get_member(self.target_uid)
             if member:
                 try:
@@ -2702,14 +3659,14 @@ class WarnReasonModal(discord.ui.Modal, title="Motiv Warn"):
         if not is_mgmt(interaction.user):
             await interaction.response.send_message("Permisiune refuzată.", ephemeral=True)
             return
-        current = get_punish_count(self.target.id)
-        if current >= 3:
+        # Single atomic write: bumps the counter (capped) and logs the warn
+        new_count, added = await adb.write(add_warn, self.actor.id, self.target.id, self.reason.value)
+        if not added:
             await interaction.response.send_message(
-                embed=make_embed("Limită", f"{self.target.mention} are deja 3/3. Reset necesar.", discord.Color.orange(), interaction.user),
+                embed=make_embed("Limită", f"{self.target.mention} are deja {new_count}/{WARN_LIMIT}. Reset necesar.", discord.Color.orange(), interaction.user),
                 ephemeral=True
             )
             return
-        new_count = increment_punish_count(self.target.id)
         emb = _warn_embed(self.actor, self.target, "Avertisment",
                           f"Avertizat de {self.actor.mention}\nWarn {new_count}/3\n\n{self.reason.value}",
                           discord.Color.red() if new_count == 3 else discord.Color.orange())
@@ -2752,7 +3709,7 @@ class WarnResetModal(discord.ui.Modal, title="Reset Warn-uri"):
         if not has_role(interaction.user, CONDUCERE_ROLE_ID):
             await interaction.response.send_message("Doar Conducere poate reseta.", ephemeral=True)
             return
-        reset_punish_count(self.target.id)
+        await adb.write(reset_punish_count, self.target.id, self.actor.id, self.note.value.strip())
         emb = _warn_embed(self.actor, self.target, "Reset Warn-uri",
                           f"Resetat de {self.actor.mention}.\n{self.note.value.strip()}", discord.Color.green())
         _send_warn_to_channel(interaction.guild, emb)
@@ -2800,11 +3757,16 @@ class WarnActionView(discord.ui.View):
         if not is_mgmt(interaction.user):
             await interaction.response.send_message("Permisiune refuzată.", ephemeral=True)
             return
-        count = get_punish_count(self.target.id)
+        count, history = await adb.read(get_warn_status, self.target.id)
         emb = _warn_embed(interaction.user, self.target, "Status Warn", f"{self.target.mention} are {count}/3.", discord.Color.blurple())
         _send_warn_to_channel(interaction.guild, emb)
         await interaction.response.send_message(
-            embed=make_embed("Status trimis", f"{self.target.mention} are {count}/3.", discord.Color.blurple(), interaction.user),
+            embed=make_embed(
+                "Status trimis",
+                f"{self.target.mention} are {count}/3.\n\n" + _format_warn_history(history),
+                discord.Color.blurple(),
+                interaction.user
+            ),
             ephemeral=True
         )
         try:
@@ -2916,10 +3878,7 @@ class AddMinutesModal(discord.ui.Modal, title="Adaugă Minute"):
             return
 
         # Replicate /adaugaminute logic
-        if self.is_sas:
-            sessions = get_clock_times_sas(self.target.id, date_str)
-        else:
-            sessions = get_clock_times(self.target.id, date_str)
+        sessions = await adb.read(get_clock_times, self.target.id, date_str, dept=_dept(self.is_sas))
 
         # Pick a unique start time beginning at 00:00:00 to avoid duplicates.
         occupied = {s[0] for s in sessions if s and s[0]}
@@ -2933,13 +3892,11 @@ class AddMinutesModal(discord.ui.Modal, title="Adaugă Minute"):
             new_co = base_dt.replace(hour=23, minute=59, second=59)
 
         # Insert new session (finished)
+        dept = _dept(self.is_sas)
+        await adb.write(add_closed_session, self.target.id, date_str, base_dt.strftime("%H:%M:%S"), new_co.strftime("%H:%M:%S"), dept=dept)
         if self.is_sas:
-            add_clock_in_sas(self.target.id, date_str, base_dt.strftime("%H:%M:%S"))
-            update_clock_out_sas(self.target.id, date_str, new_co.strftime("%H:%M:%S"), base_dt.strftime("%H:%M:%S"))
             msg = f"Sesiune nouă SAS {base_dt.strftime('%H:%M:%S')} -> {new_co.strftime('%H:%M:%S')} ({minutes_val:.0f}m)"
         else:
-            add_clock_in(self.target.id, date_str, base_dt.strftime("%H:%M:%S"))
-            update_clock_out(self.target.id, date_str, new_co.strftime("%H:%M:%S"), base_dt.strftime("%H:%M:%S"))
             msg = f"Sesiune nouă {base_dt.strftime('%H:%M:%S')} -> {new_co.strftime('%H:%M:%S')} ({minutes_val:.0f}m)"
         
         await interaction.response.send_message(
@@ -3025,14 +3982,14 @@ class RemovePontajButton(discord.ui.Button):
         if not is_mgmt(interaction.user):
             await interaction.response.send_message("Permisiune refuzată.", ephemeral=True)
             return
-        sessions = get_clock_times(self.parent_view.target.id, self.parent_view.date_str)
+        sessions = await adb.read(get_clock_times, self.parent_view.target.id, self.parent_view.date_str)
         if self.idx < 1 or self.idx > len(sessions):
             await interaction.response.send_message("Index invalid (a fost modificat între timp).", ephemeral=True)
             return
         session = sessions[self.idx - 1]
         # Remove by start time
         try:
-            remove_session(self.parent_view.target.id, self.parent_view.date_str, session[0])
+            await adb.write(remove_session, self.parent_view.target.id, self.parent_view.date_str, session[0])
         except Exception:
             await interaction.response.send_message("Eroare la ștergere.", ephemeral=True)
             return
@@ -3062,7 +4019,7 @@ class RemovePontajButton(discord.ui.Button):
         await interaction.response.edit_message(
             embed=make_embed(
                 "Pontaj șters",
-                f"{self.parent_view.target.mention} | {self.parent_view.date_str}\nȘters index #{self.idx}: {session}",
+                f"{self.parent_view.target.mention} | {self.parent_view.date_str}\nȘters index #{self.idx}: {session[:2]}",
                 discord.Color.green(),
                 interaction.user
             ),
@@ -3112,7 +4069,7 @@ class RemovePontajDateModal(discord.ui.Modal, title="Dată Pontaj"):
                 ephemeral=True
             )
             return
-        sessions = get_clock_times(self.target.id, date_str)
+        sessions = await adb.read(get_clock_times, self.target.id, date_str)
         if not sessions:
             await interaction.response.send_message(
                 embed=make_embed("Fără sesiuni", f"Nimic pentru {self.target.mention} la {date_str}.", discord.Color.orange(), interaction.user),
@@ -3171,12 +4128,8 @@ async def _send_eod_confirm_request(uid: int, *, is_sas: bool, date: str, start_
     Ask the user to confirm saving the open session by reacting ✅ within the window.
     DM first; if DM blocked, post in the appropriate guild channel.
     """
-    start_dt = parse_local(date, start_time)
-    end_dt = parse_local(date, end_time)
-    
-    # Calculate minutes
-    mins = (end_dt - start_dt).total_seconds() / 60.0
-    rounded = round_minutes(mins)
+    # Minutes as they will be stored
+    rounded = session_minutes(to_epoch(date, start_time), to_epoch(date, end_time))
     
     # Determine reminder text based on end_time
     reminder = "**NU UITA SA PORNESTI PONTAJUL DUPA ORA 00:00**" if end_time == "23:59:59" else "**POTI PORNI PONTAJUL DUPA ORA 05:30**"
@@ -3229,10 +4182,7 @@ async def _finalize_eod_confirm_after(message_id: int, delay: int):
         return
     # Not confirmed -> delete the open session (do not save)
     try:
-        if data["is_sas"]:
-            remove_session_sas(data["uid"], data["date"], data["ci"])
-        else:
-            remove_session(data["uid"], data["date"], data["ci"])
+        await adb.write(remove_session, data["uid"], data["date"], data["ci"], dept=_dept(data["is_sas"]))
     except Exception:
         pass
     # Update the confirmation message (expired)
@@ -3286,6 +4236,7 @@ class Bot(commands.Bot):
         self._console_task: asyncio.Task | None = None
         self._console_webhooks: Dict[int, discord.Webhook] = {}
         self.pending_eod_confirms: Dict[int, Dict[str, Any]] = {}
+        self._backfill_task: asyncio.Task | None = None
 
     async def setup_hook(self):
         try:
@@ -3317,6 +4268,13 @@ class Bot(commands.Bot):
             pass
         if self._console_task is None:
             self._console_task = self.loop.create_task(self._console_relay())
+
+    async def close(self):
+        await super().close()
+        # Report workers are separate processes; drop queued renders nobody will send
+        report_pool.shutdown()
+        # Let the DB writer commit what is still queued before the process exits
+        await asyncio.to_thread(adb.shutdown)
     
     async def _get_console_webhook(self, channel: discord.TextChannel) -> discord.Webhook | None:
         """Get or create the webhook used for console relay in this channel."""
@@ -3389,41 +4347,23 @@ class Bot(commands.Bot):
             if hasattr(self, 'last_auto_close_night') and self.last_auto_close_night == day:
                 return
             
-            # Filter sessions: only those starting between 00:00 and 05:30 TODAY
-            pd_night = []
-            sas_night = []
-            
-            for uid, date, ci in get_ongoing_sessions():
-                if date == day:  # Current day
-                    # Parse start time to check if it's between 00:00 and 05:25
-                    try:
-                        hour, minute = map(int, ci.split(":")[:2])
-                        if hour < 5 or (hour == 5 and minute <= 25):  # 00:00 to 05:25
-                            pd_night.append((uid, date, ci))
-                    except Exception:
-                        pass
-            
-            for uid, date, ci in get_ongoing_sessions_sas():
-                if date == day:  # Current day
-                    try:
-                        hour, minute = map(int, ci.split(":")[:2])
-                        if hour < 5 or (hour == 5 and minute <= 25):  # 00:00 to 05:25
-                            sas_night.append((uid, date, ci))
-                    except Exception:
-                        pass
-            
-            sent_pd = 0
-            sent_sas = 0
-            
-            for uid, date, ci in pd_night:
-                ok = await _send_eod_confirm_request(uid, is_sas=False, date=date, start_time=ci, end_time="05:30:00")
-                if ok:
-                    sent_pd += 1
+            # Filter sessions: only those starting between 00:00 and 05:30 TODAY (all departments, one query)
+            night = []
+            for dept, uid, date, ci in await adb.read(get_ongoing_sessions_all, day):
+                # Parse start time to check if it's between 00:00 and 05:25
+                try:
+                    hour, minute = map(int, ci.split(":")[:2])
+                    if hour < 5 or (hour == 5 and minute <= 25):  # 00:00 to 05:25
+                        night.append((dept, uid, date, ci))
+                except Exception:
+                    pass
             
-            for uid, date, ci in sas_night:
-                ok = await _send_eod_confirm_request(uid, is_sas=True, date=date, start_time=ci, end_time="05:30:00")
+            sent = {DEPT_PD: 0, DEPT_SAS: 0}
+            for dept, uid, date, ci in night:
+                ok = await _send_eod_confirm_request(uid, is_sas=dept == DEPT_SAS, date=date, start_time=ci, end_time="05:30:00")
                 if ok:
-                    sent_sas += 1
+                    sent[dept] = sent.get(dept, 0) + 1
+            sent_pd, sent_sas = sent[DEPT_PD], sent[DEPT_SAS]
             
             self.last_auto_close_night = day
             summary = f"Night shift confirm (05:25) trimis pentru {day}: PD={sent_pd} SAS={sent_sas} (fereastră {EOD_CONFIRM_WINDOW_SECS//60}m)"
@@ -3440,19 +4380,12 @@ class Bot(commands.Bot):
             if self.last_auto_close_day == day:
                 return  # already processed
             
-            pd_open = [(uid, date, ci) for uid, date, ci in get_ongoing_sessions() if date == day]
-            sas_open = [(uid, date, ci) for uid, date, ci in get_ongoing_sessions_sas() if date == day]
-
-            sent_pd = 0
-            sent_sas = 0
-            for uid, date, ci in pd_open:
-                ok = await _send_eod_confirm_request(uid, is_sas=False, date=date, start_time=ci, end_time="23:59:59")
+            sent = {DEPT_PD: 0, DEPT_SAS: 0}
+            for dept, uid, date, ci in await adb.read(get_ongoing_sessions_all, day):
+                ok = await _send_eod_confirm_request(uid, is_sas=dept == DEPT_SAS, date=date, start_time=ci, end_time="23:59:59")
                 if ok:
-                    sent_pd += 1
-            for uid, date, ci in sas_open:
-                ok = await _send_eod_confirm_request(uid, is_sas=True, date=date, start_time=ci, end_time="23:59:59")
-                if ok:
-                    sent_sas += 1
+                    sent[dept] = sent.get(dept, 0) + 1
+            sent_pd, sent_sas = sent[DEPT_PD], sent[DEPT_SAS]
 
             self.last_auto_close_day = day
             summary = f"EOD confirm (23:55) trimis pentru {day}: PD={sent_pd} SAS={sent_sas} (fereastră {EOD_CONFIRM_WINDOW_SECS//60}m)"
@@ -3505,15 +4438,6 @@ def is_csas(member: discord.Member) -> bool:
 def round_minutes(m: float) -> int:
     return round(m / 5) * 5
 
-def minutes_diff(start: datetime.datetime, end: datetime.datetime) -> int:
-    # Normalize both to aware datetimes in configured timezone
-    tz = ZoneInfo(TIMEZONE)
-    if start.tzinfo is None:
-        start = start.replace(tzinfo=tz)
-    if end.tzinfo is None:
-        end = end.replace(tzinfo=tz)
-    return int((end - start).total_seconds() // 60)
-
 def _drain_stdin(timeout: float = 0.2) -> None:
     """
     Drain pending data from STDIN without blocking so only new lines
@@ -3596,6 +4520,45 @@ def in_sas_actiuni_channel_check():
 @bot.event
 async def on_ready():
     logging.info(f"Logged in as {bot.user} ({bot.user.id})")
+    # Members are chunked by now (members intent); (re)build the index, also after reconnects
+    for guild in bot.guilds:
+        member_index.rebuild(guild)
+    try:
+        await dashboards.start()
+    except Exception:
+        logging.exception("Live dashboards failed to start")
+    sheets.start()
+    sheets_outbox.start()
+    if bot._backfill_task is None:
+        bot._backfill_task = asyncio.create_task(_backfill_epochs())
+
+async def _backfill_epochs() -> None:
+    try:
+        updated = await backfill_epochs()
+    except Exception:
+        logging.exception("Session epoch backfill failed")
+        return
+    if updated:
+        logging.info("Backfilled epochs for %s sessions", updated)
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    member_index.upsert(member)
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    member_index.rebuild(guild)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    # Members lose the role without a member update event per member
+    member_index.rebuild(role.guild)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.display_name != after.display_name:
+        callsigns.invalidate(after.id)
+    member_index.upsert(after)
 
 @bot.event
 async def on_member_remove(member: discord.Member):
@@ -3603,6 +4566,8 @@ async def on_member_remove(member: discord.Member):
     Fires when a member leaves (voluntary leave, kick, or after ban).
     Sends: "<discordId> <username> has left the server" to LEAVE_CHANNEL_ID if set.
     """
+    member_index.remove(member)
+    callsigns.invalidate(member.id)
     if LEAVE_CHANNEL_ID is None:
         return  # Not configured
     channel = member.guild.get_channel(LEAVE_CHANNEL_ID)
@@ -3636,16 +4601,8 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
         
         try:
             # Save session
-            if data["is_sas"]:
-                update_clock_out_sas(data["uid"], data["date"], end_time)
-            else:
-                update_clock_out(data["uid"], data["date"], end_time)
-
-            # Compute minutes for the saved interval
-            start_dt = parse_local(data["date"], data["ci"])
-            end_dt = parse_local(data["date"], end_time)
-            mins = (end_dt - start_dt).total_seconds() / 60.0
-            rounded = round_minutes(mins)
+            duration = await adb.write(update_clock_out, data["uid"], data["date"], end_time, data["ci"], dept=_dept(data["is_sas"]))
+            rounded = duration or 0  # minutes as stored for the saved interval
 
             # Edit message -> confirmed + show minutes
             try:
@@ -4114,8 +5071,82 @@ async def relay_cmd(ctx: commands.Context):
         view=RelayButtons()
     )
 
-@bot.command(name="dbv", aliases=["dbvacumm"], help="Checkpoint WAL + VACUUM (owner only)")
-async def dbvacuum_prefix(ctx: commands.Context):
+# --------------- DB maintenance ---------------
+MAINT_REPORT_EVERY = 2.0  # seconds between progress edits
+_maintenance_lock = asyncio.Lock()
+
+async def run_db_maintenance(channel: discord.abc.Messageable, *, full_vacuum: bool = False, backup: bool = True) -> str:
+    """
+    Checkpoint + incremental vacuum (small batches on the writer, clock-ins interleave between them)
+    + online backup on a reader thread. Progress is edited into one message in `channel`.
+    """
+    if _maintenance_lock.locked():
+        await channel.send(embed=make_embed("Mentenanță DB", "Rulează deja.", discord.Color.orange()))
+        return "busy"
+    async with _maintenance_lock:
+        msg = await channel.send(embed=make_embed("Mentenanță DB", "Pornire...", discord.Color.blurple()))
+        state = {"step": "checkpoint", "detail": ""}
+        last_edit = 0.0
+
+        async def report(force: bool = False):
+            nonlocal last_edit
+            if not force and time.monotonic() - last_edit < MAINT_REPORT_EVERY:
+                return
+            last_edit = time.monotonic()
+            try:
+                await msg.edit(embed=make_embed("Mentenanță DB", f"{state['step']}: {state['detail']}", discord.Color.blurple()))
+            except Exception:
+                pass
+
+        try:
+            busy, wal_frames, done_frames = await adb.write_exclusive(wal_checkpoint, "PASSIVE")
+            state["detail"] = f"WAL {done_frames}/{wal_frames} frames"
+            await report(force=True)
+
+            if full_vacuum:
+                # One-time conversion of an old file to auto_vacuum=INCREMENTAL (blocks writes while it runs)
+                state["step"], state["detail"] = "VACUUM complet", "rulează..."
+                await report(force=True)
+                await adb.write_exclusive(checkpoint_and_vacuum)
+            elif await adb.read(auto_vacuum_mode) != 2:
+                state["step"], state["detail"] = "vacuum", "auto_vacuum nu e INCREMENTAL; rulează o dată `!dbv full`."
+                await report(force=True)
+            else:
+                start = left = await adb.read(freelist_pages)
+                state["step"] = "vacuum incremental"
+                while left > 0:
+                    prev = left
+                    left = await adb.write_exclusive(incremental_vacuum_step)
+                    state["detail"] = f"{start - left}/{start} pagini eliberate"
+                    await report()
+                    if left >= prev:
+                        break
+
+            if backup:
+                state["step"], state["detail"] = "backup", "0%"
+                await report(force=True)
+
+                def progress(remaining: int, total: int):
+                    # Called from the reader thread; the loop below publishes it
+                    pct = 100 * (total - remaining) // total if total else 100
+                    state["detail"] = f"{pct}% ({total - remaining}/{total} pagini)"
+
+                task = asyncio.ensure_future(adb.read(backup_database, None, progress))
+                while not task.done():
+                    await asyncio.wait({task}, timeout=MAINT_REPORT_EVERY)
+                    await report()
+                state["detail"] = f"salvat în `{task.result()}`"
+
+            summary = f"{state['step']}: {state['detail']}\n{await adb.read(db_stats)}"
+            await msg.edit(embed=make_embed("Mentenanță DB finalizată", summary, discord.Color.green()))
+            _append_log_line(f"[{datetime.datetime.utcnow().isoformat()}Z] [DB_MAINT] {summary}")
+            return summary
+        except Exception as e:
+            await msg.edit(embed=make_embed("Mentenanță DB eșuată", f"{state['step']}: {e}", discord.Color.red()))
+            raise
+
+@bot.command(name="dbv", aliases=["dbvacumm"], help="Checkpoint WAL + vacuum incremental + backup (owner only; `!dbv full` = VACUUM complet)")
+async def dbvacuum_prefix(ctx: commands.Context, mode: str = ""):
     OWNER_ID = 286492096242909185
     if ctx.author.id != OWNER_ID:
         try:
@@ -4124,8 +5155,7 @@ async def dbvacuum_prefix(ctx: commands.Context):
             pass
         return
     try:
-        checkpoint_and_vacuum()
-        await ctx.reply(f"VACUUM OK. {db_stats()}", mention_author=False)
+        await run_db_maintenance(ctx.channel, full_vacuum=(mode.lower() == "full"))
     except Exception as e:
         await ctx.reply(f"Eroare: {e}", mention_author=False)
 
@@ -4139,10 +5169,50 @@ async def db_stats_command(ctx: commands.Context):
             pass
         return
     try:
-        db_stats_text = db_stats()
-        await ctx.reply(f"DB Stats:\n{db_stats_text}", mention_author=False)
+        db_stats_text = await adb.read(db_stats)
+        failed = await adb.read(outbox_failed)
+        failed_text = "".join(f"\nSheets respins: {rng} = {values} ({err})" for _, rng, values, err, _ in failed[:5])
+        await ctx.reply(f"DB Stats:\n{db_stats_text}\nReport cache: {report_cache.stats()}\nCallsigns: {callsigns.stats()}{failed_text}", mention_author=False)
+    except Exception as e:
+        await ctx.reply(f"Eroare: {e}", mention_author=False)
+
+@bot.command(name="dbt", aliases=["dbtotals"], help="Reconstruiește daily_totals din sesiuni (owner only)")
+async def db_totals_command(ctx: commands.Context):
+    OWNER_ID = 286492096242909185
+    if ctx.author.id != OWNER_ID:
+        try:
+            await ctx.reply("Permisiune refuzată.", mention_author=False, delete_after=5)
+        except Exception:
+            pass
+        return
+    try:
+        rows = await adb.write(rebuild_daily_totals)
+        await ctx.reply(f"daily_totals reconstruit: {rows} rânduri.", mention_author=False)
+    except Exception as e:
+        await ctx.reply(f"Eroare: {e}", mention_author=False)
+
+@bot.command(name="dashboard", help="Creează mesajul live cu cine e în tură în canalul curent (`!dashboard pd` / `!dashboard sas`)")
+async def dashboard_command(ctx: commands.Context, dept: str = "pd"):
+    dept = dept.strip().upper()
+    allowed = is_mgmt(ctx.author) if dept == "PD" else is_csas(ctx.author) if dept == "SAS" else False
+    if not allowed:
+        try:
+            await ctx.reply("Permisiune refuzată sau departament invalid (pd / sas).", mention_author=False, delete_after=5)
+        except Exception:
+            pass
+        return
+    if not isinstance(ctx.channel, discord.TextChannel):
+        return
+    try:
+        await dashboards.create(_dept(dept == "SAS"), ctx.channel)
     except Exception as e:
         await ctx.reply(f"Eroare: {e}", mention_author=False)
+        return
+    try:
+        await ctx.message.delete()
+    except Exception:
+        pass
+
 # --------------- Run ---------------
 if __name__ == "__main__":
     if not TOKEN:
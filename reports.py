@@ -0,0 +1,113 @@
+"""
+Report rendering off the event loop.
+
+The render_* functions are pure: they take plain data (ids, names, dates, minutes)
+and return the finished file bytes, so they can run in a worker process.
+ReportPool runs them on a small process pool and awaits the result.
+"""
+import asyncio
+import datetime
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+REPORT_WORKERS = max(1, min(2, (os.cpu_count() or 1) - 1))
+
+
+# ---------- Render functions (run in the workers) ----------
+
+def week_columns(dates: list[str]) -> tuple[list[str], dict[str, int]]:
+    """
+    Column labels + date -> column index. One week gets a column per day,
+    longer ranges (multiple of 7 days) a column per week labelled with its Sunday.
+    """
+    if len(dates) <= 7:
+        return ["Du", "Lu", "Ma", "Mi", "Jo", "Vi", "Sb"][:len(dates)], {d: i for i, d in enumerate(dates)}
+    labels = [datetime.date.fromisoformat(dates[i]).strftime("%d.%m") for i in range(0, len(dates), 7)]
+    return labels, {d: i // 7 for i, d in enumerate(dates)}
+
+def week_table_lines(member_ids: list[int], names: list[str], dates: list[str],
+                     uids: list[int], days: list[str], minutes: list[int], dept: str) -> list[str]:
+    """Members x columns table for the weekly / multi-week report; uids/days/minutes are daily_totals columns."""
+    labels, col_of = week_columns(dates)
+    ncols = len(labels)
+    row_of = {mid: i for i, mid in enumerate(member_ids)}
+
+    # One pass over the range's daily totals into a flat members x columns grid
+    grid = [0] * (len(member_ids) * ncols)
+    for uid, day, mins in zip(uids, days, minutes):
+        r = row_of.get(uid)
+        c = col_of.get(day)
+        if r is not None and c is not None:
+            grid[r * ncols + c] += mins
+
+    header = f"{'Nume':<25} " + " ".join(f"{d:>6}" for d in labels) + "  Total"
+    lines = [header, "-" * len(header)]
+
+    # Rows for ALL members (even with 0 total)
+    for i, name in enumerate(names):
+        cells = grid[i * ncols:(i + 1) * ncols]
+        day_str = " ".join(f"{int(m):>6}" for m in cells)
+        lines.append(f"{(name or 'Unknown')[:25]:<25} {day_str}  {int(sum(cells)):>5}")
+
+    if len(lines) == 2:  # Only header + separator (no members with the role)
+        lines.append(f"Niciun membru {dept} găsit.")
+    return lines
+
+def render_week_file(title: str, member_ids: list[int], names: list[str], dates: list[str],
+                     uids: list[int], days: list[str], minutes: list[int], dept: str) -> tuple[int, bytes]:
+    """Header + table of the weekly report as UTF-8 (with BOM) bytes; returns (member rows, body)."""
+    lines = week_table_lines(member_ids, names, dates, uids, days, minutes, dept)
+    report_lines = ["=" * 80, title.center(80), "=" * 80, ""]
+    report_lines.extend(lines)
+    return len(lines) - 2, "\n".join(report_lines).encode("utf-8-sig")
+
+def render_day_file(title: str, lines: list[str], generated_at: str) -> bytes:
+    """Full day report as a .txt body (UTF-8 with BOM)."""
+    out = [title, "=" * 80]
+    out.extend(lines)
+    out.append("-" * 80)
+    out.append(f"Generat la: {generated_at}")
+    return ("\n".join(out) + "\n").encode("utf-8-sig")
+
+def _ping() -> bool:
+    return True
+
+
+# ---------- Pool ----------
+
+class ReportPool:
+    """
+    Process pool for the render_* functions. Workers are forked once by start(), which must run
+    before the bot starts any thread or opens a database connection; where fork is unavailable
+    (Windows) or the pool breaks, rendering falls back to a thread so reports keep working.
+    """
+    def __init__(self, workers: int = REPORT_WORKERS):
+        self.workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self) -> None:
+        try:
+            ctx = multiprocessing.get_context("fork")
+        except ValueError:
+            logging.info("Report pool: fork unavailable, rendering on threads")
+            return
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=ctx)
+        self._executor.submit(_ping).result()  # with fork, all workers are launched on the first submit
+        logging.info("Report pool started with %d workers", self.workers)
+
+    async def run(self, fn, *args):
+        if self._executor is not None:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            except BrokenProcessPool:
+                logging.exception("Report pool broken, rendering on threads from now on")
+                self._executor = None
+        return await asyncio.to_thread(fn, *args)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,71 @@
+"""
+Clicks per second: a fresh sqlite3.connect() per helper call (the pre-pooling helpers)
+against the pooled ConnectionManager helpers. A click is what Clock IN does: read the
+user's sessions for the day, then open a session.
+
+    python tests/bench_connections.py [--clicks 2000]
+
+Runs in a temporary directory; the bot's clock_times.db is not touched.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _fresh_get_clock_times(user_id, date, dept):
+    conn = sqlite3.connect("clock_times.db")
+    c = conn.cursor()
+    c.execute("SELECT clock_in, clock_out, duration FROM sessions WHERE dept = ? AND user_id = ? AND date = ? ORDER BY clock_in",
+              (dept, user_id, date))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+def _fresh_add_clock_in(user_id, date, clock_in, dept, start_ts):
+    conn = sqlite3.connect("clock_times.db")
+    c = conn.cursor()
+    c.execute("INSERT INTO sessions (dept, user_id, date, clock_in, clock_out, start_ts) VALUES (?, ?, ?, ?, ?, ?)",
+              (dept, user_id, date, clock_in, None, start_ts))
+    conn.commit()
+    conn.close()
+
+
+def _clock(i: int) -> str:
+    return f"{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}"
+
+def run(clicks: int) -> None:
+    import database
+    database.init_db()
+
+    start = time.perf_counter()
+    for i in range(clicks):
+        _fresh_get_clock_times(i, "2025-01-01", database.DEPT_PD)
+        _fresh_add_clock_in(i, "2025-01-01", _clock(i), database.DEPT_PD, database.to_epoch("2025-01-01", _clock(i)))
+    before = clicks / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(clicks):
+        database.get_clock_times(i, "2025-01-02")
+        database.try_clock_in(i, "2025-01-02", _clock(i))
+    after = clicks / (time.perf_counter() - start)
+
+    print(f"{clicks} clicks: fresh connection {before:,.0f} clicks/s, pooled {after:,.0f} clicks/s ({after / before:.1f}x)")
+    database._db.close_all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clicks", type=int, default=2000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        run(args.clicks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Clock IN under a burst: N concurrent adb.write(try_clock_in, ...) calls, once with one
+commit per click (max_batch=1) and once through the group-commit writer. Prints the
+queue->commit latency of each run as reported by writer.latency_stats().
+
+    python tests/bench_group_commit.py [--clicks 200]
+
+Runs in a temporary directory; the bot's clock_times.db is not touched.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _clock(i: int) -> str:
+    return f"{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}"
+
+async def _burst(database, writer, clicks: int, date: str) -> None:
+    database.adb.writer = writer
+    start = time.perf_counter()
+    await asyncio.gather(*(database.adb.write(database.try_clock_in, i, date, _clock(i)) for i in range(clicks)))
+    elapsed = time.perf_counter() - start
+    writer.stop()
+    stats = writer.latency_stats()
+    label = "one commit per click" if writer.max_batch == 1 else "group commit"
+    print(f"{label:>20}: {clicks / elapsed:,.0f} clicks/s, p50 {stats['p50_ms']:.1f} ms, "
+          f"p99 {stats['p99_ms']:.1f} ms, mean batch {stats['batch']:.1f}")
+
+def run(clicks: int) -> None:
+    import database
+    database.init_db()
+    asyncio.run(_burst(database, database.GroupCommitWriter(max_batch=1), clicks, "2025-01-01"))
+    asyncio.run(_burst(database, database.GroupCommitWriter(), clicks, "2025-01-02"))
+    opened = database._db.get().execute("SELECT COUNT(*) FROM sessions WHERE clock_out IS NULL").fetchone()[0]
+    assert opened == 2 * clicks, opened
+    database.adb.shutdown()
+    database._db.close_all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clicks", type=int, default=200)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        run(args.clicks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    """Fully migrated in-memory database (no legacy punishments.db next to it)."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "_db", database.ConnectionManager(":memory:", on_connect=database._setup_connection))
+    database.init_db()
+    yield database
+    database._db.close_all()
+
+
+@pytest.mark.parametrize("sql, params", database.HOT_QUERIES, ids=lambda v: v[:60] if isinstance(v, str) else "")
+def test_hot_query_uses_index(db, sql, params):
+    plan = db.explain_query_plan(sql, params)
+    assert not [d for d in plan if d.startswith("SCAN sessions")], plan
+    # "SCAN (subquery-N)" walks an intermediate result, not a table
+    assert not [d for d in plan if d.startswith("SCAN ") and not d.startswith("SCAN (") and "INDEX" not in d], plan